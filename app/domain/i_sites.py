@@ -5,3 +5,7 @@ class ISitesRepository(ABC):
     @abstractmethod
     async def get_all_sites(self) -> List[str]:
         pass
+
+    async def has_site(self, name: str) -> bool:
+        # Repositories with a cached catalog override this with a set lookup
+        return name in await self.get_all_sites()
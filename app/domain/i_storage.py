@@ -1,29 +1,89 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+from app.domain.shift import Shift
+
+# History events, recorded in the outbox together with the state change that caused them
+EVENT_START = "start"        # shift started: new row in the log
+EVENT_END = "end"            # shift closed: patch its row (or log it whole if it has none)
+EVENT_COMPLETE = "complete"  # log a whole shift as a new row (termination)
+EVENT_MESSAGE = "message"    # standalone message row, no shift behind it
+
+HistoryEvent = Tuple[str, Shift]
 
 class IStateStorage(ABC):
     @abstractmethod
-    def get_active_shift(self, user_id: int) -> Optional[Dict[str, Any]]:
+    def get_active_shift(self, user_id: int) -> Optional[Shift]:
         pass
 
     @abstractmethod
-    def get_all_active_shifts(self) -> List[Dict[str, Any]]:
+    def get_all_active_shifts(self) -> List[Shift]:
         pass
     
     # New granular methods
     @abstractmethod
-    def create_shift(self, user_id: int) -> int:
+    def create_shift(self, user_id: int) -> Optional[str]:
+        """None if the user already has an active shift."""
+        pass
+
+    @abstractmethod
+    def allocate_event_id(self) -> str:
         pass
 
     @abstractmethod
-    def update_shift(self, shift_id: int, data: Dict[str, Any]):
+    def update_shift(self, shift_id: str, data: Dict[str, Any], event: Optional[HistoryEvent] = None):
+        pass
+
+    @abstractmethod
+    def record_event(self, kind: str, shift: Shift):
         pass
 
     @abstractmethod
     def remove_active_shift(self, user_id: int) -> bool:
         pass
 
+    @abstractmethod
+    def archive_closed_shifts(self, batch_size: int = 500) -> int:
+        pass
+
 class IHistoryStorage(ABC):
+    name = "history"      # outbox cursor key, must be unique per backend
+    assigns_rows = False  # True if log_start_shift returns the row number used for the end patch
+
+    @abstractmethod
+    async def log_completed_shift(self, shift: Shift) -> bool:
+        pass
+
+class IAsyncStateStorage(ABC):
+    """Same contract as IStateStorage, safe to await from the event loop."""
+    @abstractmethod
+    async def get_active_shift(self, user_id: int) -> Optional[Shift]:
+        pass
+
+    @abstractmethod
+    async def get_all_active_shifts(self) -> List[Shift]:
+        pass
+
+    @abstractmethod
+    async def create_shift(self, user_id: int) -> Optional[str]:
+        """None if the user already has an active shift."""
+        pass
+
+    @abstractmethod
+    async def allocate_event_id(self) -> str:
+        pass
+
+    @abstractmethod
+    async def update_shift(self, shift_id: str, data: Dict[str, Any], event: Optional[HistoryEvent] = None):
+        pass
+
+    @abstractmethod
+    async def record_event(self, kind: str, shift: Shift):
+        pass
+
+    @abstractmethod
+    async def remove_active_shift(self, user_id: int) -> bool:
+        pass
+
     @abstractmethod
-    async def log_completed_shift(self, shift_data: Dict[str, Any]) -> bool:
+    async def archive_closed_shifts(self, batch_size: int = 500) -> int:
         pass
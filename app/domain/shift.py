@@ -0,0 +1,58 @@
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+@dataclass(slots=True)
+class Shift:
+    """A shift as stored in SQLite, plus the derived fields history backends log."""
+    shift_id: str
+    user_id: int
+    start_time: Optional[datetime] = None
+    project: Optional[str] = None
+    start_geo: Optional[str] = None
+    start_video_id: Optional[str] = None
+    status: Optional[str] = None
+    start_video_path: Optional[str] = None
+    sheet_row: Optional[int] = None
+    end_time: Optional[datetime] = None
+    end_geo: Optional[str] = None
+    end_video_id: Optional[str] = None
+    comment: Optional[str] = None
+    is_active: bool = True
+    # Not stored in active_shifts: filled in by the controller for logging
+    user_name: str = ""
+    hours: Optional[float] = None
+    end_video_path: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "Shift":
+        """Builds from a sqlite3.Row; timestamps arrive already decoded."""
+        return cls(*(row[name] for name in STORED_FIELDS))
+
+    def to_payload(self) -> Dict[str, Any]:
+        """JSON-safe dict of all fields (timestamps as ISO strings)."""
+        payload = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            payload[f.name] = value.isoformat(" ") if isinstance(value, datetime) else value
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "Shift":
+        shift = cls(**payload)
+        for name in ("start_time", "end_time"):
+            value = getattr(shift, name)
+            if isinstance(value, str):
+                setattr(shift, name, datetime.fromisoformat(value))
+        return shift
+
+    def apply(self, data: Dict[str, Any]):
+        """Mirrors an update_shift() payload onto the record."""
+        for key, value in data.items():
+            setattr(self, key, value)
+
+# Columns of active_shifts / shift_history, in Shift field order
+STORED_FIELDS = (
+    "shift_id", "user_id", "start_time", "project", "start_geo", "start_video_id", "status",
+    "start_video_path", "sheet_row", "end_time", "end_geo", "end_video_id", "comment", "is_active"
+)
@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+# Blocking work is split by kind, so a slow Google API can't starve local file I/O.
+# Sheets writes, site reads and Drive uploads go through the async transport and need no thread.
+EXECUTOR_SIZES: Dict[str, int] = {
+    "sheets": 2,  # Blocking googleapiclient calls (user sync), service-account token refresh
+    "files": 4,   # Local Excel/journal I/O
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Shared named pool, created on first use (see EXECUTOR_SIZES)."""
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=EXECUTOR_SIZES[name], thread_name_prefix=name)
+            _executors[name] = executor
+        return executor
+
+def shutdown_executors(wait: bool = True):
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait)
+        _executors.clear()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+import aiohttp
+from multidict import CIMultiDictProxy
+from google.oauth2.credentials import Credentials as UserCredentials
+from app.infrastructure.google.request_executor import GoogleApiError, GoogleRequestExecutor, get_request_executor
+from app.infrastructure.executors import get_executor
+
+class AsyncGoogleTransport:
+    """
+    Calls the Google REST endpoints directly on one aiohttp session (pooled keep-alive
+    connections), so in-flight requests cost a coroutine instead of a thread.
+    Pacing and retries follow the shared GoogleRequestExecutor policy.
+    Access tokens of the existing credentials are refreshed in-loop (OAuth user
+    credentials) when they expire or the API answers 401.
+    """
+    def __init__(self, credentials, requests: GoogleRequestExecutor = None,
+                 limit: int = 64, timeout: float = 60.0):
+        self.credentials = credentials
+        self.requests = requests or get_request_executor()
+        self.limit = limit
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use: a session belongs to the running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def request(self, api: str, method: str, url: str, *, params: Dict[str, Any] = None,
+                      json: Any = None, headers: Dict[str, str] = None, file_path: str = None,
+                      timeout: float = None) -> Tuple[Any, CIMultiDictProxy]:
+        """
+        One API call under the `api` rate bucket, retried per the shared policy.
+        `file_path` streams a local file as the body (re-opened on every attempt).
+        Returns (parsed JSON body or {}, response headers; case-insensitive lookup).
+        """
+        async def send():
+            return await self._send(method, url, params, json, headers, file_path, timeout)
+        return await self.requests.execute_async(api, send)
+
+    async def _send(self, method, url, params, json, headers, file_path, timeout, _retry_auth=True):
+        all_headers = dict(headers or {})
+        all_headers["Authorization"] = f"Bearer {await self._token()}"
+        kwargs = {"params": params, "headers": all_headers}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        body = None
+        try:
+            if file_path is not None:
+                body = open(file_path, "rb")
+                all_headers["Content-Length"] = str(os.path.getsize(file_path))
+                kwargs["data"] = body # aiohttp reads file bodies off the loop
+            elif json is not None:
+                kwargs["json"] = json
+            async with self.session.request(method, url, **kwargs) as resp:
+                if resp.status == 401 and _retry_auth:
+                    await self._refresh(force=True)
+                    return await self._send(method, url, params, json, headers, file_path, timeout, False)
+                text = await resp.text()
+                if resp.status >= 400:
+                    retry_after = resp.headers.get("Retry-After")
+                    try:
+                        retry_after = float(retry_after) if retry_after is not None else None
+                    except ValueError:
+                        retry_after = None
+                    raise GoogleApiError(resp.status, text[:500], retry_after)
+                data = await resp.json(content_type=None) if text else {}
+                return data, resp.headers
+        except aiohttp.ClientError as e:
+            raise ConnectionError(str(e)) from e # Retryable, like httplib2's socket errors
+        finally:
+            if body is not None:
+                body.close()
+
+    # --- OAuth ---
+
+    async def _token(self) -> str:
+        if not self.credentials.valid:
+            await self._refresh()
+        return self.credentials.token
+
+    async def _refresh(self, force: bool = False):
+        token = self.credentials.token
+        async with self._refresh_lock:
+            # Someone else refreshed while we waited
+            if self.credentials.token != token or (not force and self.credentials.valid):
+                return
+            creds = self.credentials
+            if isinstance(creds, UserCredentials) and creds.refresh_token:
+                await self._refresh_user(creds)
+            else:
+                # Service accounts sign a JWT grant: leave that to google-auth, off the loop
+                from google.auth.transport.requests import Request
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(get_executor("sheets"), creds.refresh, Request())
+
+    async def _refresh_user(self, creds: UserCredentials):
+        form = {
+            "grant_type": "refresh_token",
+            "refresh_token": creds.refresh_token,
+            "client_id": creds.client_id,
+            "client_secret": creds.client_secret,
+        }
+        async with self.session.post(creds.token_uri, data=form) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status >= 400:
+                raise GoogleApiError(resp.status, str(data.get("error_description") or data))
+        creds.token = data["access_token"]
+        # google-auth keeps expiry as naive UTC
+        creds.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=int(data.get("expires_in", 3600)))
@@ -1,57 +1,81 @@
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 from typing import Optional
 import os
+from app.infrastructure.google.request_executor import GoogleRequestExecutor, get_request_executor
+from app.infrastructure.google.service_pool import ServicePool
+from app.infrastructure.google.async_transport import AsyncGoogleTransport
 
 class GoogleDriveManager:
     """Менеджер для работы с Google Drive"""
     
     SCOPES = ['https://www.googleapis.com/auth/drive']
+    UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
     
-    def __init__(self, credentials_path: str = None, oauth_creds=None):
+    def __init__(self, credentials_path: str = None, oauth_creds=None, requests: GoogleRequestExecutor = None):
         self.credentials_path = credentials_path
         self.oauth_creds = oauth_creds
-        self.service = None
+        self.credentials = None
+        self._services: Optional[ServicePool] = None
+        self._transport: Optional[AsyncGoogleTransport] = None
+        # Rate limiting + retries, shared with the Sheets manager
+        self.requests = requests or get_request_executor()
         self._authenticate()
     
     def _authenticate(self):
         try:
             if self.oauth_creds:
-                self.service = build('drive', 'v3', credentials=self.oauth_creds)
-                return
-            
-            if not self.credentials_path:
-                raise ValueError("Credentials missing")
-            
-            credentials = service_account.Credentials.from_service_account_file(
-                self.credentials_path, scopes=self.SCOPES
-            )
-            self.service = build('drive', 'v3', credentials=credentials)
+                self.credentials = self.oauth_creds
+            else:
+                if not self.credentials_path:
+                    raise ValueError("Credentials missing")
+                
+                self.credentials = service_account.Credentials.from_service_account_file(
+                    self.credentials_path, scopes=self.SCOPES
+                )
+            self._services = ServicePool('drive', 'v3', self.credentials)
+            self._services.get() # Fail early on a broken setup
             
         except Exception as e:
             print(f"Drive Auth Error: {e}")
+
+    @property
+    def service(self):
+        """The calling thread's own service object (see ServicePool)."""
+        return self._services.get() if self._services else None
     
-    def upload_file(self, local_file_path: str, parent_folder_id: Optional[str] = None, new_name: Optional[str] = None) -> Optional[str]:
+    @property
+    def transport(self) -> AsyncGoogleTransport:
+        if self._transport is None:
+            self._transport = AsyncGoogleTransport(self.credentials, self.requests)
+        return self._transport
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    async def upload_file_async(self, local_file_path: str, parent_folder_id: Optional[str] = None, new_name: Optional[str] = None) -> Optional[str]:
+        """Uploads over the async transport: opens a resumable session, then PUTs the file. Returns the webViewLink."""
         try:
             if not os.path.exists(local_file_path):
                 return None
-            
+
             file_name = new_name if new_name else os.path.basename(local_file_path)
             file_metadata = {'name': file_name}
             if parent_folder_id:
                 file_metadata['parents'] = [parent_folder_id]
-            
-            media = MediaFileUpload(local_file_path, resumable=True)
-            
-            file = self.service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id, webViewLink'
-            ).execute()
-            
+
+            _, headers = await self.transport.request(
+                "drive", "POST", self.UPLOAD_URL,
+                params={"uploadType": "resumable", "fields": "id,webViewLink"},
+                json=file_metadata
+            )
+            # The session URL carries the upload id; a retried PUT restarts the body on it
+            file, _ = await self.transport.request(
+                "drive", "PUT", headers["Location"], file_path=local_file_path, timeout=600
+            )
+
             return file.get('webViewLink') # Return Link directly for usage
-            
+
         except Exception as e:
             print(f"Upload Error: {e}")
             return None
@@ -63,7 +87,7 @@ class GoogleDriveManager:
             if parent_id:
                 query += f" and '{parent_id}' in parents"
             
-            results = self.service.files().list(q=query, fields="files(id)").execute()
+            results = self.requests.execute("drive", self.service.files().list(q=query, fields="files(id)"))
             files = results.get('files', [])
             
             if files:
@@ -77,7 +101,7 @@ class GoogleDriveManager:
             if parent_id:
                 metadata['parents'] = [parent_id]
                 
-            folder = self.service.files().create(body=metadata, fields='id').execute()
+            folder = self.requests.execute("drive", self.service.files().create(body=metadata, fields='id'))
             return folder.get('id')
         except Exception as e:
             print(f"Folder Error: {e}")
@@ -0,0 +1,192 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from googleapiclient.errors import HttpError
+
+# Per-user quotas (requests per minute, burst). The bot runs on one OAuth user,
+# so the per-user limits are the ones we hit first.
+DEFAULT_LIMITS: Dict[str, Tuple[float, int]] = {
+    "sheets_read": (60, 10),
+    "sheets_write": (60, 10),
+    "drive": (600, 20),
+}
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class GoogleApiError(Exception):
+    """Non-2xx answer from the REST API (async transport)."""
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; acquire() blocks until one is free."""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Takes one token, returns how long we waited for it."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def reserve(self) -> float:
+        """Takes one token now (possibly on credit); returns how long to wait before using it."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def drain(self, seconds: float):
+        """Quota exceeded server-side: hold new requests back for about `seconds`."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+class GoogleRequestExecutor:
+    """
+    Runs googleapiclient requests for the Sheets and Drive managers:
+    rate-limited per API with token buckets sized to the quotas, retried on 429/5xx and
+    network errors with exponential backoff + full jitter, honouring Retry-After.
+    Writes are merged upstream (SheetsWriteBatcher), so this only paces and retries.
+    """
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = None, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 64.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {
+            api: TokenBucket(per_minute / 60.0, burst)
+            for api, (per_minute, burst) in (limits or DEFAULT_LIMITS).items()
+        }
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = {
+            api: {"requests": 0, "failures": 0, "retries": 0, "throttled": 0,
+                  "waiting": 0, "wait_seconds": 0.0}
+            for api in self._buckets
+        }
+
+    def execute(self, api: str, request: Any) -> Any:
+        """Executes `request` (an HttpRequest) under the `api` bucket. Re-raises once retries run out."""
+        bucket = self._buckets[api]
+        attempt = 0
+        while True:
+            self._count(api, "waiting", 1)
+            try:
+                waited = bucket.acquire()
+            finally:
+                self._count(api, "waiting", -1)
+            self._count(api, "wait_seconds", waited)
+            self._count(api, "requests", 1)
+            try:
+                return request.execute()
+            except Exception as e:
+                delay = self._backoff(api, bucket, e, attempt)
+                attempt += 1
+                time.sleep(delay)
+
+    async def execute_async(self, api: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Same policy for the async transport: `send` performs one attempt; waits never block the loop."""
+        bucket = self._buckets[api]
+        attempt = 0
+        while True:
+            self._count(api, "waiting", 1)
+            try:
+                waited = bucket.reserve()
+                if waited:
+                    await asyncio.sleep(waited)
+            finally:
+                self._count(api, "waiting", -1)
+            self._count(api, "wait_seconds", waited)
+            self._count(api, "requests", 1)
+            try:
+                return await send()
+            except Exception as e:
+                delay = self._backoff(api, bucket, e, attempt)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _backoff(self, api: str, bucket: TokenBucket, e: Exception, attempt: int) -> float:
+        """Delay before the next attempt; re-raises `e` if it isn't worth retrying."""
+        status = self._status(e)
+        if status == 429:
+            self._count(api, "throttled", 1)
+        if attempt >= self.max_retries or not self._retryable(e, status):
+            self._count(api, "failures", 1)
+            raise e
+        delay = self._retry_after(e)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if status == 429:
+            bucket.drain(delay) # Others on this API back off too
+        self._count(api, "retries", 1)
+        return delay
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Snapshot per API: requests, failures, retries, throttled (429s), waiting (queue depth), wait_seconds."""
+        with self._lock:
+            return {api: dict(m) for api, m in self._metrics.items()}
+
+    def _count(self, api: str, name: str, value: float):
+        with self._lock:
+            self._metrics[api][name] += value
+
+    @staticmethod
+    def _status(e: Exception) -> Optional[int]:
+        if isinstance(e, GoogleApiError):
+            return e.status
+        if isinstance(e, HttpError):
+            try:
+                return int(e.resp.status)
+            except Exception:
+                return None
+        return None
+
+    @staticmethod
+    def _retryable(e: Exception, status: Optional[int]) -> bool:
+        if status is not None:
+            return status in RETRYABLE_STATUSES
+        return isinstance(e, (socket.timeout, ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+    @staticmethod
+    def _retry_after(e: Exception) -> Optional[float]:
+        if isinstance(e, GoogleApiError):
+            return e.retry_after
+        if not isinstance(e, HttpError):
+            return None
+        try:
+            value = e.resp.get("retry-after")
+            return float(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+_shared: Optional[GoogleRequestExecutor] = None
+_shared_lock = threading.Lock()
+
+def get_request_executor() -> GoogleRequestExecutor:
+    """One executor per process, so Sheets and Drive managers share the same quota accounting."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = GoogleRequestExecutor()
+        return _shared
@@ -0,0 +1,26 @@
+import threading
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+class ServicePool:
+    """
+    One googleapiclient service per thread. httplib2 (under every service) is not
+    thread-safe, so threads never share one; each thread keeps its own Http, which
+    reuses its keep-alive connection to the API host between calls.
+    """
+    def __init__(self, api: str, version: str, credentials, timeout: float = 60.0):
+        self.api = api
+        self.version = version
+        self.credentials = credentials
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+            # Bundled discovery document: building per thread is local, no network
+            service = build(self.api, self.version, http=http, cache_discovery=False)
+            self._local.service = service
+        return service
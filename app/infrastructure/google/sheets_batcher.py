@@ -0,0 +1,131 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from app.infrastructure.google.sheets_manager import GoogleSheetsManager
+
+class _PendingWrite:
+    __slots__ = ("spreadsheet_id", "row", "row_num", "ranges", "color", "future")
+
+    def __init__(self, spreadsheet_id: str, row: Optional[List[Any]], row_num: Optional[int],
+                 ranges: Optional[List[Tuple[str, List[List[Any]]]]], color: Optional[dict],
+                 future: asyncio.Future):
+        self.spreadsheet_id = spreadsheet_id
+        self.row = row            # append: the row values
+        self.row_num = row_num    # update: the target row
+        self.ranges = ranges      # update: (range, values) pairs
+        self.color = color
+        self.future = future
+
+class SheetsWriteBatcher:
+    """
+    Write-behind queue for one sheet. Appends and updates arriving within `window` seconds
+    (or until `max_batch` are queued) go out together: one multi-row append, one
+    values.batchUpdate and one formatting batchUpdate per spreadsheet, whatever the batch size.
+    Each caller still gets its own result (row number for appends, bool for updates).
+    """
+    def __init__(self, manager: GoogleSheetsManager, sheet_name: str = "Shifts",
+                 window: float = 0.5, max_batch: int = 100):
+        self.manager = manager
+        self.sheet_name = sheet_name
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[_PendingWrite] = []
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def append(self, spreadsheet_id: str, row: List[Any], color: dict = None) -> Optional[int]:
+        """Queues a row append; returns its 1-based row number (None on failure)."""
+        return await self._enqueue(spreadsheet_id, row, None, None, color)
+
+    async def update(self, spreadsheet_id: str, row_num: int,
+                     ranges: List[Tuple[str, List[List[Any]]]], color: dict = None) -> bool:
+        """Queues value updates (and optional row colour) for an existing row."""
+        return await self._enqueue(spreadsheet_id, None, row_num, ranges, color)
+
+    async def _enqueue(self, spreadsheet_id, row, row_num, ranges, color):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingWrite(spreadsheet_id, row, row_num, ranges, color, future))
+        if self._closed:
+            await self.flush()
+        else:
+            self._ensure_task()
+            self._wake.set()
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+        return await future
+
+    def _ensure_task(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            try:
+                # Give the rest of a check-in wave the chance to join this batch
+                await asyncio.wait_for(self._full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Sheets Batch Error: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                try:
+                    results = await self._write(batch)
+                except Exception as e:
+                    print(f"Sheets Batch Error: {e}")
+                    results = [None if item.row is not None else False for item in batch]
+                for item, result in zip(batch, results):
+                    if not item.future.done():
+                        item.future.set_result(result)
+
+    async def close(self):
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _write(self, batch: List[_PendingWrite]) -> List[Any]:
+        results: Dict[int, Any] = {}
+        by_sheet: Dict[str, List[int]] = {}
+        for i, item in enumerate(batch):
+            by_sheet.setdefault(item.spreadsheet_id, []).append(i)
+
+        for sid, indexes in by_sheet.items():
+            formats: List[Tuple[int, dict]] = []
+
+            appends = [i for i in indexes if batch[i].row is not None]
+            if appends:
+                # One append keeps the rows contiguous, so row k lands at first + k
+                result = await self.manager.append_data_async(sid, f"{self.sheet_name}!A1", [batch[i].row for i in appends])
+                first = self.manager.first_row(result) if result else None
+                for k, i in enumerate(appends):
+                    row_num = first + k if first else None
+                    results[i] = row_num
+                    if row_num and batch[i].color:
+                        formats.append((row_num, batch[i].color))
+
+            updates = [i for i in indexes if batch[i].row is None]
+            if updates:
+                data = [r for i in updates for r in batch[i].ranges]
+                ok = await self.manager.batch_update_data_async(sid, data)
+                for i in updates:
+                    results[i] = ok
+                    if ok and batch[i].color:
+                        formats.append((batch[i].row_num, batch[i].color))
+
+            # Colouring is cosmetic: a failure here doesn't fail the writes
+            await self.manager.format_rows_async(sid, self.sheet_name, formats)
+
+        return [results.get(i) for i in range(len(batch))]
@@ -1,40 +1,60 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Dict, Set, Tuple
 import os
+import threading
+from urllib.parse import quote
+from app.infrastructure.google.request_executor import GoogleRequestExecutor, get_request_executor
+from app.infrastructure.google.service_pool import ServicePool
+from app.infrastructure.google.async_transport import AsyncGoogleTransport
 
 class GoogleSheetsManager:
     """Менеджер для работы с Google Sheets"""
     
     SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    API_URL = "https://sheets.googleapis.com/v4/spreadsheets"
     
-    def __init__(self, credentials_path: str = None, oauth_creds=None):
+    def __init__(self, credentials_path: str = None, oauth_creds=None, requests: GoogleRequestExecutor = None):
         self.credentials_path = credentials_path
         self.oauth_creds = oauth_creds
-        self.service = None
+        self.credentials = None
+        self._services: Optional[ServicePool] = None
+        self._transport: Optional[AsyncGoogleTransport] = None
+        # Rate limiting + retries, shared with the Drive manager
+        self.requests = requests or get_request_executor()
+        # spreadsheet_id -> sheet title -> {"sheetId", "rowCount", "columnCount"}
+        self._meta: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._headers_ok: Set[Tuple[str, str]] = set()
+        self._meta_lock = threading.Lock()
         self._authenticate()
     
     def _authenticate(self):
         try:
             if self.oauth_creds:
-                self.service = build('sheets', 'v4', credentials=self.oauth_creds)
-                return
-            
-            if not self.credentials_path: 
-                raise ValueError("Credentials missing")
-                
-            credentials = service_account.Credentials.from_service_account_file(
-                self.credentials_path, scopes=self.SCOPES
-            )
-            self.service = build('sheets', 'v4', credentials=credentials)
+                self.credentials = self.oauth_creds
+            else:
+                if not self.credentials_path: 
+                    raise ValueError("Credentials missing")
+                    
+                self.credentials = service_account.Credentials.from_service_account_file(
+                    self.credentials_path, scopes=self.SCOPES
+                )
+            self._services = ServicePool('sheets', 'v4', self.credentials)
+            self._services.get() # Fail early on a broken setup
         except Exception as e:
             print(f"Sheets Auth Error: {e}")
 
+    @property
+    def service(self):
+        """The calling thread's own service object (see ServicePool)."""
+        return self._services.get() if self._services else None
+
     def create_spreadsheet(self, title: str) -> Optional[str]:
         """Creates a new spreadsheet and returns ID."""
         try:
             spreadsheet = {'properties': {'title': title}}
-            spreadsheet = self.service.spreadsheets().create(body=spreadsheet, fields='spreadsheetId').execute()
+            spreadsheet = self.requests.execute("sheets_write",
+                self.service.spreadsheets().create(body=spreadsheet, fields='spreadsheetId'))
             return spreadsheet.get('spreadsheetId')
         except Exception as e:
             print(f"Create Sheet Error: {e}")
@@ -66,20 +86,18 @@ class GoogleSheetsManager:
         if sid and share_email:
              # Share logic
              try:
-                 drive_service = build('drive', 'v3', credentials=self.service._http.credentials) 
-                 # accessing credentials from service object might work if cached
-                 # or just re-build
+                 drive_service = build('drive', 'v3', credentials=self.credentials)
                  
                  permission = {
                     'type': 'user',
                     'role': 'writer',
                     'emailAddress': share_email
                  }
-                 drive_service.permissions().create(
+                 self.requests.execute("drive", drive_service.permissions().create(
                     fileId=sid,
                     body=permission,
                     fields='id'
-                 ).execute()
+                 ))
                  print(f"Shared with {share_email}")
              except Exception as e:
                  print(f"Share Error: {e}")
@@ -89,12 +107,12 @@ class GoogleSheetsManager:
         """Appends data and returns the API response dict."""
         try:
             body = {'values': values}
-            result = self.service.spreadsheets().values().append(
+            result = self.requests.execute("sheets_write", self.service.spreadsheets().values().append(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='USER_ENTERED',
                 body=body
-            ).execute()
+            ))
             return result
         except Exception as e:
             print(f"Sheets Append Error: {e}")
@@ -103,9 +121,9 @@ class GoogleSheetsManager:
     def get_all_values(self, spreadsheet_id: str, range_name: str) -> List[List[Any]]:
         """Reads all values from range."""
         try:
-            result = self.service.spreadsheets().values().get(
+            result = self.requests.execute("sheets_read", self.service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id, range=range_name
-            ).execute()
+            ))
             return result.get('values', [])
         except Exception as e:
             print(f"Sheets Read Error: {e}")
@@ -115,63 +133,209 @@ class GoogleSheetsManager:
         """Updates specific range."""
         try:
             body = {'values': values}
-            self.service.spreadsheets().values().update(
+            self.requests.execute("sheets_write", self.service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='USER_ENTERED',
                 body=body
-            ).execute()
+            ))
             return True
         except Exception as e:
             print(f"Sheets Update Error: {e}")
             return False
 
+    def batch_update_data(self, spreadsheet_id: str, data: List[Tuple[str, List[List[Any]]]]) -> bool:
+        """Updates several ranges in one values.batchUpdate call."""
+        try:
+            body = {
+                'valueInputOption': 'USER_ENTERED',
+                'data': [{'range': range_name, 'values': values} for range_name, values in data]
+            }
+            self.requests.execute("sheets_write", self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id, body=body
+            ))
+            return True
+        except Exception as e:
+            print(f"Sheets Batch Update Error: {e}")
+            return False
+
+    # --- Metadata cache ---
+
+    METADATA_FIELDS = "sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))"
+
+    def load_metadata(self, spreadsheet_id: str) -> Dict[str, Dict[str, int]]:
+        """Fetches sheet titles, ids and grid sizes (only those fields) into the cache."""
+        result = self.requests.execute("sheets_read", self.service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields=self.METADATA_FIELDS
+        ))
+        return self._store_metadata(spreadsheet_id, result)
+
+    def _store_metadata(self, spreadsheet_id: str, result: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        sheets = {}
+        for s in result.get('sheets', []):
+            props = s['properties']
+            grid = props.get('gridProperties', {})
+            sheets[props['title']] = {
+                "sheetId": props['sheetId'],
+                "rowCount": grid.get('rowCount', 0),
+                "columnCount": grid.get('columnCount', 0)
+            }
+        with self._meta_lock:
+            self._meta[spreadsheet_id] = sheets
+        return sheets
+
+    def invalidate_metadata(self, spreadsheet_id: str):
+        with self._meta_lock:
+            self._meta.pop(spreadsheet_id, None)
+            self._headers_ok = {k for k in self._headers_ok if k[0] != spreadsheet_id}
+
+    def remember_headers(self, spreadsheet_id: str, sheet_name: str):
+        with self._meta_lock:
+            self._headers_ok.add((spreadsheet_id, sheet_name))
+
     def ensure_sheet_headers(self, spreadsheet_id: str, sheet_name: str, headers: List[str]):
-        """Simple check if sheet is empty, add headers."""
+        """Simple check if sheet is empty, add headers. Checked once per sheet."""
+        if (spreadsheet_id, sheet_name) in self._headers_ok:
+            return
         try:
-            result = self.service.spreadsheets().values().get(
+            result = self.requests.execute("sheets_read", self.service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id, range=f"{sheet_name}!A1:A1"
-            ).execute()
+            ))
             
             if 'values' not in result:
-                self.append_data(spreadsheet_id, f"{sheet_name}!A1", [headers])
+                if self.append_data(spreadsheet_id, f"{sheet_name}!A1", [headers]) is None:
+                    return
+            self.remember_headers(spreadsheet_id, sheet_name)
         except Exception:
             pass
 
-    def format_row(self, spreadsheet_id: str, sheet_name: str, row_index: int, color: dict):
-        """Sets background color for a row (row_index is 1-based)."""
+    # --- Async API (aiohttp transport, no threads) ---
+
+    @property
+    def transport(self) -> AsyncGoogleTransport:
+        if self._transport is None:
+            self._transport = AsyncGoogleTransport(self.credentials, self.requests)
+        return self._transport
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    def _values_url(self, spreadsheet_id: str, range_name: str, suffix: str = "") -> str:
+        return f"{self.API_URL}/{spreadsheet_id}/values/{quote(range_name, safe='')}{suffix}"
+
+    async def append_data_async(self, spreadsheet_id: str, range_name: str, values: List[List[Any]]) -> Any:
+        """Appends data and returns the API response dict."""
+        try:
+            result, _ = await self.transport.request(
+                "sheets_write", "POST", self._values_url(spreadsheet_id, range_name, ":append"),
+                params={"valueInputOption": "USER_ENTERED"}, json={"values": values}
+            )
+            return result
+        except Exception as e:
+            print(f"Sheets Append Error: {e}")
+            return None
+
+    async def get_all_values_async(self, spreadsheet_id: str, range_name: str) -> List[List[Any]]:
+        """Reads all values from range."""
         try:
-            # Need sheet ID by name
-            spreadsheet = self.service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            sheet_id = 0
-            for s in spreadsheet.get('sheets', []):
-                if s['properties']['title'] == sheet_name:
-                    sheet_id = s['properties']['sheetId']
-                    break
+            result, _ = await self.transport.request(
+                "sheets_read", "GET", self._values_url(spreadsheet_id, range_name)
+            )
+            return result.get('values', [])
+        except Exception as e:
+            print(f"Sheets Read Error: {e}")
+            return []
 
+    async def batch_update_data_async(self, spreadsheet_id: str, data: List[Tuple[str, List[List[Any]]]]) -> bool:
+        """Updates several ranges in one values.batchUpdate call."""
+        try:
             body = {
-                "requests": [
-                    {
-                        "repeatCell": {
-                            "range": {
-                                "sheetId": sheet_id,
-                                "startRowIndex": row_index - 1,
-                                "endRowIndex": row_index,
-                                "startColumnIndex": 0,
-                                "endColumnIndex": 15 # Up to column O
-                            },
-                            "cell": {
-                                "userEnteredFormat": {
-                                    "backgroundColor": color
-                                }
-                            },
-                            "fields": "userEnteredFormat.backgroundColor"
-                        }
-                    }
-                ]
+                'valueInputOption': 'USER_ENTERED',
+                'data': [{'range': range_name, 'values': values} for range_name, values in data]
             }
-            self.service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            await self.transport.request(
+                "sheets_write", "POST", f"{self.API_URL}/{spreadsheet_id}/values:batchUpdate", json=body
+            )
             return True
         except Exception as e:
+            print(f"Sheets Batch Update Error: {e}")
+            return False
+
+    async def load_metadata_async(self, spreadsheet_id: str) -> Dict[str, Dict[str, int]]:
+        result, _ = await self.transport.request(
+            "sheets_read", "GET", f"{self.API_URL}/{spreadsheet_id}", params={"fields": self.METADATA_FIELDS}
+        )
+        return self._store_metadata(spreadsheet_id, result)
+
+    async def get_sheet_properties_async(self, spreadsheet_id: str, sheet_name: str) -> Optional[Dict[str, int]]:
+        """Cached properties of one sheet; refreshes once if the sheet is unknown (e.g. just added)."""
+        with self._meta_lock:
+            props = self._meta.get(spreadsheet_id, {}).get(sheet_name)
+        if props is None:
+            props = (await self.load_metadata_async(spreadsheet_id)).get(sheet_name)
+        return props
+
+    async def format_rows_async(self, spreadsheet_id: str, sheet_name: str, rows: List[Tuple[int, dict]],
+                                _retry: bool = True) -> bool:
+        """Sets background colors for several rows (1-based) in one batchUpdate."""
+        if not rows:
+            return True
+        try:
+            # Sheet ID by name, from the metadata cache
+            props = await self.get_sheet_properties_async(spreadsheet_id, sheet_name)
+            if props is None:
+                print(f"Format Row Error: sheet '{sheet_name}' not found")
+                return False
+            await self.transport.request(
+                "sheets_write", "POST", f"{self.API_URL}/{spreadsheet_id}:batchUpdate",
+                json=self._format_body(props["sheetId"], rows)
+            )
+            return True
+        except Exception as e:
+            if _retry and self._is_stale_sheet_error(e):
+                # Sheet was deleted/recreated: cached sheetId is stale
+                self.invalidate_metadata(spreadsheet_id)
+                return await self.format_rows_async(spreadsheet_id, sheet_name, rows, _retry=False)
             print(f"Format Row Error: {e}")
             return False
+
+    @staticmethod
+    def _format_body(sheet_id: int, rows: List[Tuple[int, dict]]) -> Dict[str, Any]:
+        return {
+            "requests": [
+                {
+                    "repeatCell": {
+                        "range": {
+                            "sheetId": sheet_id,
+                            "startRowIndex": row_index - 1,
+                            "endRowIndex": row_index,
+                            "startColumnIndex": 0,
+                            "endColumnIndex": 15 # Up to column O
+                        },
+                        "cell": {
+                            "userEnteredFormat": {
+                                "backgroundColor": color
+                            }
+                        },
+                        "fields": "userEnteredFormat.backgroundColor"
+                    }
+                }
+                for row_index, color in rows
+            ]
+        }
+
+    @staticmethod
+    def first_row(append_result: Any) -> Optional[int]:
+        """1-based row number of the first row written by an append (from updates.updatedRange)."""
+        try:
+            range_str = append_result['updates']['updatedRange']
+            start_cell = range_str.split('!')[-1].split(':')[0]
+            return int("".join(filter(str.isdigit, start_cell)))
+        except Exception:
+            return None
+
+    @staticmethod
+    def _is_stale_sheet_error(e: Exception) -> bool:
+        text = str(e)
+        return "No grid with id" in text or "not found" in text.lower()
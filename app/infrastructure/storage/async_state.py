@@ -0,0 +1,35 @@
+from typing import Dict, Any, Optional, List
+from app.domain.i_storage import IAsyncStateStorage, HistoryEvent
+from app.domain.shift import Shift
+from app.infrastructure.storage.sqlite_state import SqliteStateStorage
+from app.infrastructure.storage.db_executor import DbExecutor, get_db_executor
+
+class AsyncSqliteStateStorage(IAsyncStateStorage):
+    """Runs SqliteStateStorage on the DB executor thread instead of the event loop."""
+    def __init__(self, storage: SqliteStateStorage, executor: DbExecutor = None):
+        self.storage = storage
+        self.executor = executor or get_db_executor(storage.pool)
+
+    async def get_active_shift(self, user_id: int) -> Optional[Shift]:
+        return await self.executor.read(self.storage.get_active_shift, user_id)
+
+    async def get_all_active_shifts(self) -> List[Shift]:
+        return await self.executor.read(self.storage.get_all_active_shifts)
+
+    async def create_shift(self, user_id: int) -> Optional[str]:
+        return await self.executor.write(self.storage.create_shift, user_id)
+
+    async def allocate_event_id(self) -> str:
+        return await self.executor.write(self.storage.allocate_event_id)
+
+    async def update_shift(self, shift_id: str, data: Dict[str, Any], event: Optional[HistoryEvent] = None):
+        return await self.executor.write(self.storage.update_shift, shift_id, data, event)
+
+    async def record_event(self, kind: str, shift: Shift):
+        return await self.executor.write(self.storage.record_event, kind, shift)
+
+    async def remove_active_shift(self, user_id: int) -> bool:
+        return await self.executor.write(self.storage.remove_active_shift, user_id)
+
+    async def archive_closed_shifts(self, batch_size: int = 500) -> int:
+        return await self.executor.write(self.storage.archive_closed_shifts, batch_size)
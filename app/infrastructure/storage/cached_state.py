@@ -0,0 +1,80 @@
+from dataclasses import replace
+from typing import Dict, Any, Optional, List
+from app.domain.i_storage import IAsyncStateStorage, HistoryEvent
+from app.domain.shift import Shift
+
+class CachedStateStorage(IAsyncStateStorage):
+    """
+    Write-through in-memory index of live shifts in front of the SQLite storage.
+    Every write goes to the database first and is applied to the index only after
+    it committed, so after a crash the index is simply reloaded from SQLite.
+    Once loaded, the index is authoritative for active shifts: lookups are dict hits.
+    """
+    def __init__(self, storage: IAsyncStateStorage):
+        self.storage = storage
+        self._by_user: Dict[int, Shift] = {}
+        self._user_of: Dict[str, int] = {} # shift_id -> user_id
+        self._loaded = False
+
+    async def load(self):
+        shifts = await self.storage.get_all_active_shifts()
+        self._by_user.clear()
+        self._user_of.clear()
+        for shift in shifts:
+            self._put(shift)
+        self._loaded = True
+
+    def _put(self, shift: Shift):
+        self._by_user[shift.user_id] = shift
+        self._user_of[shift.shift_id] = shift.user_id
+
+    def _drop(self, user_id: int):
+        shift = self._by_user.pop(user_id, None)
+        if shift:
+            self._user_of.pop(shift.shift_id, None)
+
+    async def get_active_shift(self, user_id: int) -> Optional[Shift]:
+        if not self._loaded:
+            return await self.storage.get_active_shift(user_id)
+        shift = self._by_user.get(user_id)
+        # Copy: callers must not mutate the index behind the database's back
+        return replace(shift) if shift else None
+
+    async def get_all_active_shifts(self) -> List[Shift]:
+        if not self._loaded:
+            return await self.storage.get_all_active_shifts()
+        return [replace(s) for s in self._by_user.values()]
+
+    async def create_shift(self, user_id: int) -> Optional[str]:
+        shift_id = await self.storage.create_shift(user_id)
+        if shift_id and self._loaded:
+            # One read-back per shift start keeps defaults/timestamps exactly as stored
+            shift = await self.storage.get_active_shift(user_id)
+            if shift:
+                self._put(shift)
+        return shift_id
+
+    async def allocate_event_id(self) -> str:
+        return await self.storage.allocate_event_id()
+
+    async def update_shift(self, shift_id: str, data: Dict[str, Any], event: Optional[HistoryEvent] = None):
+        await self.storage.update_shift(shift_id, data, event)
+        user_id = self._user_of.get(shift_id)
+        if user_id is None:
+            return
+        if "is_active" in data and not data["is_active"]:
+            self._drop(user_id)
+        else:
+            self._by_user[user_id].apply(data)
+
+    async def record_event(self, kind: str, shift: Shift):
+        await self.storage.record_event(kind, shift)
+
+    async def remove_active_shift(self, user_id: int) -> bool:
+        result = await self.storage.remove_active_shift(user_id)
+        self._drop(user_id)
+        return result
+
+    async def archive_closed_shifts(self, batch_size: int = 500) -> int:
+        # Only closed rows move, and those are never in the index
+        return await self.storage.archive_closed_shifts(batch_size)
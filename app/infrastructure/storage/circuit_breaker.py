@@ -0,0 +1,99 @@
+import time
+from typing import Any, Optional
+from app.domain.i_storage import IHistoryStorage
+from app.domain.shift import Shift
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures;
+    open -> half-open after `reset_timeout` seconds, letting one probe call through;
+    half-open -> closed on success, back to open on failure.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False # One probe at a time
+            self._probing = True
+        return self.state != self.OPEN
+
+    @property
+    def healthy(self) -> bool:
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._set(self.CLOSED)
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                self._set(self.OPEN)
+
+    def _set(self, state: str):
+        print(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+
+class BreakerHistoryStorage(IHistoryStorage):
+    """
+    Circuit breaker around one history backend: while open, calls fail immediately with
+    CircuitOpenError instead of waiting out HTTP timeouts on executor threads.
+    A falsy result counts as a failure (backends report most errors that way).
+    """
+    def __init__(self, storage: IHistoryStorage, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.storage = storage
+        self.name = storage.name
+        self.assigns_rows = storage.assigns_rows
+        self.breaker = CircuitBreaker(storage.name, failure_threshold, reset_timeout)
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.healthy
+
+    async def _guarded(self, method: str, *args, ok=bool) -> Any:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit open")
+        try:
+            result = await getattr(self.storage, method)(*args)
+        except BaseException:
+            # Cancellation by the composite's timeout counts too: the backend hung
+            self.breaker.record_failure()
+            raise
+        if ok(result):
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return result
+
+    async def log_completed_shift(self, shift: Shift) -> bool:
+        return await self._guarded("log_completed_shift", shift)
+
+    async def log_start_shift(self, shift: Shift) -> Optional[int]:
+        # Only a row-assigning backend signals failure with None
+        return await self._guarded("log_start_shift", shift,
+                                   ok=lambda row: row is not None or not self.assigns_rows)
+
+    async def update_shift_end(self, row_num: int, shift: Shift) -> bool:
+        return await self._guarded("update_shift_end", row_num, shift)
@@ -1,59 +1,210 @@
-from typing import List, Dict, Any
+from typing import List, Any, Awaitable, Callable, Dict, Optional, Tuple
 import asyncio
-from app.domain.i_storage import IHistoryStorage
+import time
+from app.domain.i_storage import IHistoryStorage, EVENT_START, EVENT_END, EVENT_COMPLETE, EVENT_MESSAGE
+from app.domain.shift import Shift
+from app.infrastructure.storage.circuit_breaker import CircuitOpenError
 
-class CompositeHistoryStorage(IHistoryStorage):
+# (backend, seq, kind, shift_id, row_num) -> called once a mirror applied an outbox event
+ReplicatedCallback = Callable[[str, int, str, str, Optional[int]], Awaitable[None]]
+# (backend, seq) -> called when a mirror gave up on an outbox event (the outbox resends it)
+DroppedCallback = Callable[[str, int], None]
+
+class _Mirror:
+    """Bounded in-process replication queue + worker for one mirror backend."""
+    def __init__(self, storage: IHistoryStorage, maxsize: int):
+        self.storage = storage
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.task: Optional[asyncio.Task] = None
+        self.rows: Dict[str, int] = {} # shift_id -> row, for mirrors that assign rows
+        self.replicated = 0
+        self.dropped = 0
+        self.dropped_shifts: Dict[str, float] = {} # shift_id -> when its event was handed back
+        self.last_lag = 0.0
+        self.head_since: Optional[float] = None # enqueue time of the event being applied
+
+    def lag(self) -> float:
+        """Age of the oldest event not yet applied (0 when caught up)."""
+        return time.monotonic() - self.head_since if self.head_since is not None else 0.0
+
+class CompositeHistoryStorage:
     """
-    Writes to multiple storages in parallel.
+    Routes outbox events (see OutboxDispatcher, which drains one lane per backend) to the
+    history backends. Every backend call has its own timeout (`timeouts` by backend name,
+    else `default_timeout`), so a hung backend is cut off.
+
+    With `primary` set, the composite replicates: only the primary is written directly;
+    the other backends are mirrors fed from bounded in-process queues (at most
+    `mirror_queue_size` events each) and applied in order by a worker per mirror.
+    While the primary reports itself unhealthy (circuit open, see BreakerHistoryStorage)
+    the mirrors are promoted: they are written directly once their queue has drained.
+    A mirror tries the head of its queue `mirror_attempts` times, then hands the event back
+    to the outbox (on_dropped) and moves on, so one bad event can't stall the queue.
     """
-    def __init__(self, storages: List[IHistoryStorage]):
+    def __init__(self, storages: List[IHistoryStorage], timeouts: Dict[str, float] = None,
+                 default_timeout: float = 30.0, primary: str = None,
+                 mirror_queue_size: int = 1000, enqueue_timeout: float = 1.0, mirror_attempts: int = 5):
         self.storages = storages
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.primary = primary
+        self.enqueue_timeout = enqueue_timeout
+        self.mirror_attempts = mirror_attempts
+        self.mirrors: Dict[str, _Mirror] = {
+            s.name: _Mirror(s, mirror_queue_size) for s in storages if primary and s.name != primary
+        }
+        self.on_replicated: Optional[ReplicatedCallback] = None # set by OutboxDispatcher
+        self.on_dropped: Optional[DroppedCallback] = None
+
+    def _timeout(self, storage: IHistoryStorage) -> float:
+        return self.timeouts.get(storage.name, self.default_timeout)
+
+    async def _call(self, storage: IHistoryStorage, method: str, *args) -> Any:
+        fn = getattr(storage, method)
+        if asyncio.iscoroutinefunction(fn):
+            return await asyncio.wait_for(fn(*args), timeout=self._timeout(storage))
+        return fn(*args)
+
+    def primary_healthy(self) -> bool:
+        primary = next((s for s in self.storages if s.name == self.primary), None)
+        return primary is None or getattr(primary, "healthy", True)
+
+    def _is_async_mirror(self, name: str) -> bool:
+        """Mirror currently fed through its queue (not promoted by a primary failover)."""
+        mirror = self.mirrors.get(name)
+        if mirror is None:
+            return False
+        if self.primary_healthy():
+            return True
+        # Promoted, but only once caught up: direct writes must not overtake queued ones
+        return not mirror.queue.empty() or mirror.head_since is not None
+
+    # --- Outbox delivery ---
 
-    async def log_completed_shift(self, shift_data: Dict[str, Any]) -> bool:
-        success = True
-        for storage in self.storages:
+    def names(self) -> List[str]:
+        return [storage.name for storage in self.storages]
+
+    async def dispatch(self, backend: str, kind: str, shift: Shift, row_num: Optional[int],
+                       seq: int = None) -> Tuple[Optional[bool], Optional[int]]:
+        """
+        Delivers one outbox event to one backend (OutboxDispatcher runs a lane per backend).
+        Returns (delivered, row number the backend assigned or None); delivered is None
+        when a mirror queued the event: on_replicated reports it later.
+        """
+        if self._is_async_mirror(backend):
+            queued = await self._replicate(self.mirrors[backend], kind, shift, row_num, seq)
+            return (None if queued else False), None
+        storage = next(s for s in self.storages if s.name == backend)
+        return await self._deliver(storage, kind, shift, row_num)
+
+    async def _deliver(self, storage: IHistoryStorage, kind: str, shift: Shift,
+                       row_num: Optional[int]) -> Tuple[bool, Optional[int]]:
+        try:
+            if kind in (EVENT_START, EVENT_MESSAGE):
+                row = await self._call(storage, "log_start_shift", shift)
+                # Backends that don't hand out rows report failure by raising
+                ok = row is not None or not storage.assigns_rows
+                return ok, row if kind == EVENT_START else None
+            if kind == EVENT_END:
+                if storage.assigns_rows:
+                    # Rows recorded before the outbox existed still live on the shift
+                    row_num = row_num or shift.sheet_row
+                if row_num or not storage.assigns_rows:
+                    return bool(await self._call(storage, "update_shift_end", row_num, shift)), None
+                return bool(await self._call(storage, "log_completed_shift", shift)), None
+            if kind == EVENT_COMPLETE:
+                return bool(await self._call(storage, "log_completed_shift", shift)), None
+            print(f"Storage Error: unknown history event '{kind}'")
+            return True, None # Nothing to deliver; don't block the queue
+        except CircuitOpenError:
+            return False, None # Expected during an outage; the breaker logs its own transitions
+        except Exception as e:
+            # Timeouts included: the write may still land. Replays are safe: Google looks up
+            # the Event ID (or joins the append in flight), Excel upserts, end patches repeat
+            print(f"Storage Error ({storage.name}): {e!r}")
+            return False, None
+
+    # --- Replication (primary/mirror mode) ---
+
+    async def _replicate(self, mirror: _Mirror, kind: str, shift: Shift, row_num: Optional[int],
+                         seq: Optional[int]) -> bool:
+        """
+        Queues an event for a mirror. A full queue pushes back for at most `enqueue_timeout`;
+        after that the event is left in the outbox, which retries it later.
+        """
+        if mirror.task is None:
+            mirror.task = asyncio.create_task(self._mirror_worker(mirror))
+        item = (kind, shift, row_num, seq, time.monotonic())
+        try:
+            await asyncio.wait_for(mirror.queue.put(item), timeout=self.enqueue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _mirror_worker(self, mirror: _Mirror):
+        name = mirror.storage.name
+        while True:
+            kind, shift, row_num, seq, enqueued = await mirror.queue.get()
+            mirror.head_since = enqueued
+            if kind == EVENT_END and not row_num:
+                row_num = mirror.rows.get(shift.shift_id)
+            delay = 1.0
+            # Queued behind a dropped event of the same shift: must not overtake its resend
+            behind_drop = enqueued < mirror.dropped_shifts.get(shift.shift_id, 0.0)
             try:
-                # Some storages might be async, some sync?
-                # Assume all implement correct interface.
-                # If interface says async, we await.
-                if asyncio.iscoroutinefunction(storage.log_completed_shift):
-                     res = await storage.log_completed_shift(shift_data)
+                for attempt in range(0 if behind_drop else self.mirror_attempts):
+                    if attempt:
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, 60.0)
+                    ok, assigned = await self._deliver(mirror.storage, kind, shift, row_num)
+                    if ok:
+                        break
                 else:
-                    res = storage.log_completed_shift(shift_data)
-                
-                if not res:
-                    success = False
+                    # Back to the outbox, whose lane retries it with the rest of the shift
+                    mirror.dropped += 1
+                    if not behind_drop:
+                        print(f"Replication: {name} gave up on {kind} {shift.shift_id}")
+                        mirror.dropped_shifts[shift.shift_id] = time.monotonic()
+                    if seq is not None and self.on_dropped:
+                        self.on_dropped(name, seq)
+                    continue
+                mirror.dropped_shifts.pop(shift.shift_id, None)
+                if kind == EVENT_START and assigned:
+                    mirror.rows[shift.shift_id] = assigned
+                elif kind in (EVENT_END, EVENT_COMPLETE):
+                    mirror.rows.pop(shift.shift_id, None)
+                mirror.replicated += 1
+                mirror.last_lag = time.monotonic() - enqueued
+                if seq is not None and self.on_replicated:
+                    await self.on_replicated(name, seq, kind, shift.shift_id, assigned)
             except Exception as e:
-                print(f"Storage Error: {e}")
-                success = False
-        return success
-
-    async def log_start_shift(self, shift_data: Dict[str, Any]) -> Any:
-        result_row = None
-        for storage in self.storages:
-            if hasattr(storage, 'log_start_shift'):
-                try:
-                    res = None
-                    if asyncio.iscoroutinefunction(storage.log_start_shift):
-                         res = await storage.log_start_shift(shift_data)
-                    else:
-                         res = storage.log_start_shift(shift_data)
-                    
-                    if res is not None and result_row is None:
-                        result_row = res
-                except Exception:
-                    pass
-        return result_row
-
-    async def update_shift_end(self, row_num: int, shift_data: Dict[str, Any]) -> bool:
-        success = True
-        for storage in self.storages:
-            if hasattr(storage, 'update_shift_end'):
-                try:
-                    if asyncio.iscoroutinefunction(storage.update_shift_end):
-                         await storage.update_shift_end(row_num, shift_data)
-                    else:
-                         storage.update_shift_end(row_num, shift_data)
-                except Exception:
-                    success = False
-        return success
+                print(f"Replication Error ({name}): {e!r}")
+            finally:
+                mirror.head_since = None
+                mirror.queue.task_done()
+
+    def replication_status(self) -> Dict[str, Dict[str, float]]:
+        """Per mirror: queued events, current lag (s), lag of the last applied event (s), applied and dropped counts."""
+        return {
+            name: {
+                "promoted": not self._is_async_mirror(name),
+                "queued": m.queue.qsize(),
+                "lag": m.lag(),
+                "last_lag": m.last_lag,
+                "replicated": m.replicated,
+                "dropped": m.dropped,
+            }
+            for name, m in self.mirrors.items()
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Gives the mirrors `timeout` seconds to catch up; the outbox replays the rest on restart."""
+        for name, mirror in self.mirrors.items():
+            if mirror.task is None:
+                continue
+            try:
+                await asyncio.wait_for(mirror.queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"Replication: {mirror.queue.qsize()} events left for {name}")
+            mirror.task.cancel()
+            mirror.task = None
@@ -0,0 +1,123 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+from app.infrastructure.storage.sqlite_connection import SqliteConnectionPool
+
+class _Job:
+    __slots__ = ("fn", "args", "future", "is_write")
+
+    def __init__(self, fn: Callable, args: tuple, is_write: bool):
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.is_write = is_write
+
+class DbExecutor:
+    """
+    Dedicated thread that owns all SQLite work for one DB file, so the asyncio loop
+    never waits on disk I/O. Writes queued back-to-back are group-committed:
+    each runs in its own savepoint inside one transaction, so a failing write
+    doesn't roll back its neighbours and the batch pays for a single commit.
+    """
+    def __init__(self, pool: SqliteConnectionPool, max_batch: int = 64):
+        self.pool = pool
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-executor", daemon=True)
+        self._thread.start()
+
+    async def read(self, fn: Callable, *args) -> Any:
+        return await self._submit(fn, args, is_write=False)
+
+    async def write(self, fn: Callable, *args) -> Any:
+        return await self._submit(fn, args, is_write=True)
+
+    async def _submit(self, fn: Callable, args: tuple, is_write: bool) -> Any:
+        job = _Job(fn, args, is_write)
+        self._queue.put(job)
+        return await asyncio.wrap_future(job.future)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            # Drain whatever queued up meanwhile (bounded)
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._execute(batch)
+                    return
+                batch.append(nxt)
+            self._execute(batch)
+
+    def _execute(self, batch: List[_Job]):
+        # Keep submission order; group consecutive writes into one transaction
+        i = 0
+        while i < len(batch):
+            if not batch[i].is_write:
+                self._run_job(batch[i])
+                i += 1
+                continue
+            j = i
+            while j < len(batch) and batch[j].is_write:
+                j += 1
+            self._run_writes(batch[i:j])
+            i = j
+
+    def _run_job(self, job: _Job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.fn(*job.args))
+        except BaseException as e:
+            job.future.set_exception(e)
+
+    def _run_writes(self, writes: List[_Job]):
+        results: Dict[int, Any] = {}
+        errors: Dict[int, BaseException] = {}
+        try:
+            with self.pool.transaction():
+                for idx, job in enumerate(writes):
+                    try:
+                        with self.pool.transaction():
+                            results[idx] = job.fn(*job.args)
+                    except Exception as e:
+                        errors[idx] = e
+        except Exception as e:
+            # Commit itself failed: nothing in the batch is durable
+            for job in writes:
+                if job.future.set_running_or_notify_cancel():
+                    job.future.set_exception(e)
+            return
+
+        # Resolve only after commit, so callers never see non-durable results
+        for idx, job in enumerate(writes):
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if idx in errors:
+                job.future.set_exception(errors[idx])
+            else:
+                job.future.set_result(results.get(idx))
+
+    def close(self, timeout: float = 5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+_executors: Dict[str, DbExecutor] = {}
+_executors_lock = threading.Lock()
+
+def get_db_executor(pool: SqliteConnectionPool) -> DbExecutor:
+    """One DB thread per DB file, shared by every async storage on it."""
+    with _executors_lock:
+        executor = _executors.get(pool.db_file)
+        if executor is None:
+            executor = DbExecutor(pool)
+            _executors[pool.db_file] = executor
+        return executor
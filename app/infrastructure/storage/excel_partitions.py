@@ -0,0 +1,82 @@
+import os
+import json
+import calendar
+import threading
+from datetime import date
+from typing import Dict, Optional
+import pandas as pd
+
+class ExcelPartitions:
+    """
+    Layout of the Excel backup, derived from EXCEL_FILE (e.g. data/shifts_log.xlsx):
+      shifts_log_2026-10.xlsx   - Shifts of one month (one workbook per month)
+      shifts_log_reference.xlsx - Users and Sites
+      shifts_log_manifest.json  - which partition covers which dates (file, from, to),
+                                  for whoever reads the backup (reports, office staff)
+    A pre-partitioning shifts_log.xlsx is kept as a "legacy" partition covering all dates.
+    """
+    def __init__(self, base_file: str):
+        self.base_file = base_file
+        self.root, self.ext = os.path.splitext(base_file)
+        self.reference_file = f"{self.root}_reference{self.ext}"
+        self.manifest_path = f"{self.root}_manifest.json"
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(day: date) -> str:
+        return day.strftime("%Y-%m")
+
+    def partition_file(self, key: str) -> str:
+        return f"{self.root}_{key}{self.ext}"
+
+    # --- Manifest ---
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Optional[str]]]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f).get("partitions", {})
+
+    def _write_manifest(self, partitions: Dict[str, Dict[str, Optional[str]]]):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"partitions": partitions}, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.manifest_path) # Readers never see a half-written manifest
+
+    def register(self, key: str):
+        """Records a monthly partition in the manifest (no-op if already there)."""
+        with self._lock:
+            partitions = self._read_manifest()
+            if key in partitions:
+                return
+            year, month = map(int, key.split("-"))
+            partitions[key] = {
+                "file": os.path.basename(self.partition_file(key)),
+                "from": date(year, month, 1).isoformat(),
+                "to": date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+            }
+            self._write_manifest(partitions)
+
+    # --- Reference workbook ---
+
+    def ensure_reference(self):
+        """Creates the Users/Sites workbook, carrying them over from a legacy single workbook."""
+        if os.path.exists(self.reference_file):
+            return
+        users = pd.DataFrame(columns=["User ID", "Username", "Full Name", "Phone", "Registered At"])
+        sites = pd.DataFrame({"Site Name": ["Объект 1"], "Lat": [0.0], "Lon": [0.0], "Radius": [500]})
+        if os.path.exists(self.base_file):
+            try:
+                sheets = pd.read_excel(self.base_file, sheet_name=None)
+                users = sheets.get("Users", users)
+                sites = sheets.get("Sites", sites)
+                if "Shifts" in sheets:
+                    with self._lock:
+                        partitions = self._read_manifest()
+                        partitions["legacy"] = {"file": os.path.basename(self.base_file), "from": None, "to": None}
+                        self._write_manifest(partitions)
+            except Exception as e:
+                print(f"Excel Legacy Migration Error: {e}")
+        with pd.ExcelWriter(self.reference_file, engine='openpyxl') as writer:
+            users.to_excel(writer, sheet_name="Users", index=False)
+            sites.to_excel(writer, sheet_name="Sites", index=False)
@@ -1,12 +1,28 @@
 import pandas as pd
 import os
+import time
 import asyncio
-from typing import Dict, Any, List
+from typing import Dict, Any, List, FrozenSet, Optional, Tuple
+from app.domain.i_sites import ISitesRepository
+from app.infrastructure.executors import get_executor
 
-class ExcelSitesRepository:
-    def __init__(self, filepath: str):
+class ExcelSitesRepository(ISitesRepository):
+    """
+    Site catalog from the Sites sheet, cached in memory.
+    The workbook is re-read only when its mtime or size changes (checked at most
+    every `check_interval` seconds), so office edits show up within seconds.
+    A failed read (e.g. overlapping a save) keeps the previous catalog and is retried;
+    concurrent callers share one reload.
+    """
+    def __init__(self, filepath: str, check_interval: float = 2.0):
         self.filepath = filepath
         self.sheet_name = "Sites"
+        self.check_interval = check_interval
+        self._sites: List[str] = []
+        self._site_set: FrozenSet[str] = frozenset()
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._reload_lock = asyncio.Lock()
         self._ensure_file()
 
     def _ensure_file(self):
@@ -16,12 +32,46 @@ class ExcelSitesRepository:
              pass
 
     async def get_all_sites(self) -> List[str]:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._read_sync)
+        await self._refresh()
+        return self._sites
 
-    def _read_sync(self) -> List[str]:
+    async def has_site(self, name: str) -> bool:
+        await self._refresh()
+        return name in self._site_set
+
+    async def _refresh(self):
+        if self._signature is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        async with self._reload_lock:
+            # Whoever held the lock may have just reloaded
+            now = time.monotonic()
+            if self._signature is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                st = os.stat(self.filepath)
+                signature = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                signature = None
+            if signature is not None and signature == self._signature:
+                return
+
+            loop = asyncio.get_running_loop()
+            sites = await loop.run_in_executor(get_executor("files"), self._read_sync) if signature else []
+            if sites is None:
+                return # Keep the previous catalog; signature not stored, so retried next check
+            self._store(sites, signature)
+
+    def _store(self, sites: List[str], signature: Optional[Tuple[int, int]]):
+        # Replace, don't mutate: callers may still hold the previous list
+        self._sites = sites
+        self._site_set = frozenset(sites)
+        self._signature = signature
+
+    def _read_sync(self) -> Optional[List[str]]:
         try:
             df = pd.read_excel(self.filepath, sheet_name=self.sheet_name)
             return df["Site Name"].dropna().astype(str).tolist()
-        except:
-            return []
+        except Exception as e:
+            print(f"Sites Read Error: {e}")
+            return None
@@ -1,15 +1,38 @@
 import os
-import pandas as pd
-from typing import Dict, Any
+import json
+from openpyxl import Workbook, load_workbook
+from typing import Any, Dict, List, Optional
 from app.domain.i_storage import IHistoryStorage
+from app.domain.shift import Shift
+from app.infrastructure.storage.excel_partitions import ExcelPartitions
+from app.infrastructure.executors import get_executor
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
 class ExcelHistoryStorage(IHistoryStorage):
-    def __init__(self, filepath: str):
-        self.filepath = filepath
+    """
+    Local Excel backup with group commit: writes are journaled to disk immediately,
+    kept in memory and applied in one save per monthly workbook once `buffer_size` are
+    pending or the oldest is `flush_interval` seconds old. close() flushes the rest.
+    Every write is an upsert by Event ID (start row, then patched on end), located
+    through an in-memory Event ID -> row index per workbook.
+    """
+    name = "excel"
+
+    # End Time, Work Hours, End Geo, End Video, Status
+    END_COLUMNS = [6, 7, 9, 11, 12]
+
+    def __init__(self, partitions: ExcelPartitions, buffer_size: int = 50, flush_interval: float = 30.0):
+        self.partitions = partitions
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.journal_path = partitions.base_file + ".journal"
         self.lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
         self.executor = ThreadPoolExecutor(max_workers=1) # Serial writes
+        self._pending: List[Dict[str, Any]] = [] # {"row": [...], "cols": None | [indexes]}
+        self._row_index: Dict[str, Dict[str, int]] = {} # partition -> Event ID -> sheet row
+        self._flusher: Optional[asyncio.Task] = None
         # Use columns defined before
         self.columns = [
             "Event ID", "User ID", "Worker", "Project", "Date", 
@@ -17,52 +40,205 @@ class ExcelHistoryStorage(IHistoryStorage):
             "Start Geo", "End Geo", "Start Video", "End Video", "Status"
         ]
         self._init_file()
+        self._recover_journal()
 
     def _init_file(self):
-        if not os.path.exists(self.filepath):
-            with pd.ExcelWriter(self.filepath, engine='openpyxl') as writer:
-                pd.DataFrame(columns=self.columns).to_excel(writer, sheet_name="Shifts", index=False)
-                pd.DataFrame(columns=["User ID", "Username", "Full Name", "Phone", "Registered At"]).to_excel(writer, sheet_name="Users", index=False)
-                pd.DataFrame({"Site Name": ["Объект 1"], "Lat": [0.0], "Lon": [0.0], "Radius": [500]}).to_excel(writer, sheet_name="Sites", index=False)
+        # Shifts workbooks are created per month on first write
+        self.partitions.ensure_reference()
+
+    async def log_completed_shift(self, shift: Shift) -> bool:
+        return await self._enqueue({"row": self._build_row(shift), "cols": None})
 
-    async def log_completed_shift(self, shift_data: Dict[str, Any]) -> bool:
+    async def log_start_shift(self, shift: Shift) -> Optional[int]:
+        if not await self._enqueue({"row": self._build_row(shift), "cols": None}):
+            raise IOError("Excel journal unavailable") # No row number to signal failure with
+        # Sheet row numbers belong to the primary storage; ours stay internal
+        return None
+
+    async def update_shift_end(self, row_num: int, shift: Shift) -> bool:
+        # row_num is the primary's row: we locate ours by Event ID.
+        # Same columns as the Google update: end time, hours, end geo, end video, status.
+        return await self._enqueue({"row": self._build_row(shift), "cols": self.END_COLUMNS})
+
+    async def _enqueue(self, op: Dict[str, Any]) -> bool:
+        loop = asyncio.get_running_loop()
         async with self.lock:
-            loop = asyncio.get_running_loop()
-            return await loop.run_in_executor(self.executor, self._write_sync, shift_data)
+            try:
+                # Durable first (small append + fsync), then buffered for the workbook
+                await loop.run_in_executor(get_executor("files"), self._journal_sync, op)
+            except Exception as e:
+                print(f"Excel Journal Error: {e}")
+                return False
+            self._pending.append(op)
+            pending = len(self._pending)
+
+        if pending >= self.buffer_size:
+            await self.flush()
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+        return True
 
-    def _write_sync(self, shift_data: Dict[str, Any]) -> bool:
+    async def _flush_later(self):
         try:
-            start_time = shift_data['start_time']
-            end_time = shift_data['end_time']
-            
-            date_str = start_time.strftime("%Y-%m-%d")
-            start_str = start_time.strftime("%H:%M:%S")
-            end_str = end_time.strftime("%H:%M:%S")
-            status = shift_data.get('status', 'OK')
-
-            new_record = {
-                "Event ID": shift_data.get('shift_id'),
-                "User ID": shift_data.get('user_id'),
-                "Worker": shift_data['user_name'],
-                "Project": shift_data['project'],
-                "Date": date_str,
-                "Start Time": start_str,
-                "End Time": end_str,
-                "Work Hours (hrs)": shift_data['hours'],
-                "Start Geo": shift_data.get('start_geo'),
-                "End Geo": shift_data.get('end_geo'),
-                "Start Video": shift_data.get('start_video_path'),
-                "End Video": shift_data.get('end_video_path'),
-                "Status": status
-            }
-
-            df = pd.read_excel(self.filepath, sheet_name="Shifts")
-            new_row_df = pd.DataFrame([new_record])
-            df = pd.concat([df, new_row_df], ignore_index=True)
-            
-            with pd.ExcelWriter(self.filepath, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                df.to_excel(writer, sheet_name="Shifts", index=False)
-            return True
-        except Exception as e:
-            print(f"Excel Async Write Error: {e}")
-            return False
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+        finally:
+            self._flusher = None
+
+    async def flush(self) -> bool:
+        """Applies all pending writes with a single save per workbook."""
+        loop = asyncio.get_running_loop()
+        async with self._flush_lock:
+            async with self.lock:
+                if not self._pending:
+                    return True
+                ops, self._pending = self._pending, []
+                # New writes journal into a fresh file while we save
+                await loop.run_in_executor(get_executor("files"), self._rotate_journal_sync)
+
+            failed = await loop.run_in_executor(self.executor, self._write_sync, ops)
+            if not failed:
+                await loop.run_in_executor(get_executor("files"), self._drop_flushing_sync)
+            else:
+                async with self.lock:
+                    self._pending = failed + self._pending # Retry with the next flush
+            return not failed
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+        await self.flush()
+
+    # --- Journal ---
+
+    def _journal_sync(self, op: Dict[str, Any]):
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rotate_journal_sync(self):
+        flushing = self.journal_path + ".flushing"
+        if not os.path.exists(self.journal_path):
+            return
+        if os.path.exists(flushing):
+            # A previous flush failed: its writes are still pending, keep them together
+            with open(self.journal_path, encoding="utf-8") as src, open(flushing, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, flushing)
+
+    def _drop_flushing_sync(self):
+        flushing = self.journal_path + ".flushing"
+        if os.path.exists(flushing):
+            os.remove(flushing)
+
+    def _recover_journal(self):
+        """Replays writes that were journaled but never saved (crash before flush)."""
+        ops = []
+        for path in (self.journal_path + ".flushing", self.journal_path):
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        # Older journals hold bare rows
+                        ops.append(entry if isinstance(entry, dict) else {"row": entry, "cols": None})
+        if not ops:
+            return
+        # Upserts by Event ID: replaying writes that did reach the workbook is harmless
+        failed = self._write_sync(ops)
+        if not failed:
+            self._drop_flushing_sync()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            print(f"♻️ Excel: recovered {len(ops)} journaled writes")
+        else:
+            self._pending = failed # Still journaled; retried by the next flush
+
+    # --- Workbook ---
+
+    @staticmethod
+    def _partition_key(row: List[Any]) -> str:
+        return row[4][:7] # "Date" column: YYYY-MM-DD -> YYYY-MM
+
+    def _write_sync(self, ops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Applies writes to their monthly workbooks; returns the ones that could not be saved."""
+        by_partition: Dict[str, List[Dict[str, Any]]] = {}
+        for op in ops:
+            by_partition.setdefault(self._partition_key(op["row"]), []).append(op)
+        failed = []
+        for key, part_ops in sorted(by_partition.items()):
+            try:
+                self._apply_to_partition(key, part_ops)
+            except Exception as e:
+                print(f"Excel Async Write Error ({key}): {e}")
+                self._row_index.pop(key, None) # Unsaved appends: rebuild on next use
+                failed.extend(part_ops)
+        return failed
+
+    def _apply_to_partition(self, key: str, ops: List[Dict[str, Any]]):
+        path = self.partitions.partition_file(key)
+        # Write in place: no pandas read of the whole history, no sheet rewrite
+        if os.path.exists(path):
+            wb = load_workbook(path)
+            ws = wb["Shifts"]
+        else:
+            wb = Workbook()
+            ws = wb.active
+            ws.title = "Shifts"
+            ws.append(self.columns)
+            self._row_index[key] = {}
+        index = self._row_index.get(key)
+
+        for op in ops:
+            row, event_id = op["row"], str(op["row"][0])
+            if index is None:
+                index = self._build_index(ws) # Lazily, once per workbook per process
+                self._row_index[key] = index
+            row_num = index.get(event_id)
+            # Validate the cached position; the file may have been edited by hand
+            if row_num is not None and str(ws.cell(row=row_num, column=1).value) != event_id:
+                index = self._build_index(ws)
+                self._row_index[key] = index
+                row_num = index.get(event_id)
+
+            if row_num is None:
+                ws.append(row)
+                index[event_id] = ws.max_row
+            else:
+                for col in (op["cols"] if op["cols"] is not None else range(len(row))):
+                    ws.cell(row=row_num, column=col + 1, value=row[col])
+        wb.save(path)
+        self.partitions.register(key)
+
+    @staticmethod
+    def _build_index(ws) -> Dict[str, int]:
+        index = {}
+        for row_num, (value,) in enumerate(ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+            if value is not None:
+                index[str(value)] = row_num
+        return index
+
+    def _build_row(self, shift: Shift) -> List[Any]:
+        start_time = shift.start_time
+        end_time = shift.end_time
+        return [
+            shift.shift_id,                                   # Event ID
+            shift.user_id,                                    # User ID
+            shift.user_name,                                  # Worker
+            shift.project,                                    # Project
+            start_time.strftime("%Y-%m-%d"),                  # Date
+            start_time.strftime("%H:%M:%S"),                  # Start Time
+            end_time.strftime("%H:%M:%S") if end_time else None, # End Time
+            shift.hours,                                      # Work Hours (hrs)
+            shift.start_geo,                                  # Start Geo
+            shift.end_geo,                                    # End Geo
+            shift.start_video_path,                           # Start Video
+            shift.end_video_path,                             # End Video
+            shift.status or 'OK'                              # Status
+        ]
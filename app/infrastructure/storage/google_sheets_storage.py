@@ -1,12 +1,25 @@
-from typing import Dict, Any, List, Optional
 import asyncio
+from typing import Any, Dict, List, Optional
 from app.domain.i_storage import IHistoryStorage
+from app.domain.shift import Shift
 from app.infrastructure.google.sheets_manager import GoogleSheetsManager
+from app.infrastructure.google.sheets_batcher import SheetsWriteBatcher
 
 class GoogleSheetsStorage(IHistoryStorage):
+    name = "google"
+    assigns_rows = True # log_start_shift returns the sheet row patched on shift end
+
     def __init__(self, credentials_file: str = None, spreadsheet_title: str = "TG_Logs", oauth_creds = None):
         self.manager = GoogleSheetsManager(credentials_path=credentials_file, oauth_creds=oauth_creds)
         self.spreadsheet_id = None
+        # Appends/updates from concurrent shifts are merged into a few API calls
+        self.batcher = SheetsWriteBatcher(self.manager, "Shifts")
+        # Event ID -> sheet row, read from column A on first use. Makes appends idempotent:
+        # a replayed event (outbox retry after a timeout or restart) finds its row instead of
+        # adding a second one. Appends still in flight are joined, not repeated.
+        self._rows: Optional[Dict[str, int]] = None
+        self._rows_lock = asyncio.Lock()
+        self._appending: Dict[str, asyncio.Future] = {}
         
         # 15 Columns structure
         self.columns = [
@@ -18,111 +31,116 @@ class GoogleSheetsStorage(IHistoryStorage):
 
     def set_spreadsheet_id(self, sid: str):
         self.spreadsheet_id = sid
+        # Sheet ids/sizes fetched once here, then served from the manager's cache
+        try:
+            self.manager.load_metadata(sid)
+        except Exception as e:
+            print(f"Sheets Metadata Error: {e}")
         # Force update headers
-        self.manager.update_data(sid, "Shifts!A1:O1", [self.columns])
+        if self.manager.update_data(sid, "Shifts!A1:O1", [self.columns]):
+            self.manager.remember_headers(sid, "Shifts")
 
-    async def log_completed_shift(self, shift_data: Dict[str, Any]) -> bool:
+    async def log_completed_shift(self, shift: Shift) -> bool:
         if not self.spreadsheet_id: return False
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._log_sync, shift_data)
-
-    def _log_sync(self, shift_data: Dict[str, Any]) -> bool:
-        try:
-            row = self._build_row(shift_data, "OK")
-            self.manager.append_data(self.spreadsheet_id, "Shifts!A1", [row])
-            return True
-        except Exception as e:
-            print(f"Sheet Log Error: {e}")
-            return False
+        rows = await self._event_rows()
+        if rows is None: return False
+        if shift.shift_id in rows:
+            # Started row already there: finish it instead of logging the shift twice
+            return await self.update_shift_end(rows[shift.shift_id], shift)
+        return await self._append_once(shift, self._build_row(shift, "OK"), None) is not None
 
-    async def log_start_shift(self, shift_data: Dict[str, Any]) -> Optional[int]:
+    async def log_start_shift(self, shift: Shift) -> Optional[int]:
         if not self.spreadsheet_id: return None
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._log_start_sync, shift_data)
+        rows = await self._event_rows()
+        if rows is None: return None
+        if shift.shift_id in rows:
+            return rows[shift.shift_id]
+        row = self._build_row(shift, "ACTIVE")
+        # Style: Light Blue for Active
+        return await self._append_once(shift, row, {"red": 0.85, "green": 0.9, "blue": 1.0})
 
-    def _log_start_sync(self, shift_data: Dict[str, Any]) -> Optional[int]:
+    async def _append_once(self, shift: Shift, row: List[Any], color: Optional[dict]) -> Optional[int]:
+        future = self._appending.get(shift.shift_id)
+        if future is None:
+            future = asyncio.ensure_future(self._append(shift.shift_id, row, color))
+            self._appending[shift.shift_id] = future
+        # Shielded: a caller cut off by its timeout doesn't abandon the write half-way
+        return await asyncio.shield(future)
+
+    async def _append(self, event_id: str, row: List[Any], color: Optional[dict]) -> Optional[int]:
         try:
-            row = self._build_row(shift_data, "ACTIVE")
-            result = self.manager.append_data(self.spreadsheet_id, "Shifts!A1", [row])
-            
-            if result and 'updates' in result and 'updatedRange' in result['updates']:
-                range_str = result['updates']['updatedRange']
-                try:
-                    cell_range = range_str.split('!')[-1]
-                    start_cell = cell_range.split(':')[0]
-                    row_num = int("".join(filter(str.isdigit, start_cell)))
-                    
-                    # Style: Light Blue for Active
-                    self.manager.format_row(self.spreadsheet_id, "Shifts", row_num, {"red": 0.85, "green": 0.9, "blue": 1.0})
-                    
-                    return row_num
-                except: pass
-            return None
-        except Exception as e:
-            print(f"Log Start Error: {e}")
-            return None
+            row_num = await self.batcher.append(self.spreadsheet_id, row, color)
+            if row_num:
+                self._rows[event_id] = row_num
+            return row_num
+        finally:
+            self._appending.pop(event_id, None)
 
-    async def update_shift_end(self, row_num: int, shift_data: Dict[str, Any]) -> bool:
+    async def _event_rows(self) -> Optional[Dict[str, int]]:
+        """The Event ID index (None while the sheet can't be read: don't append blind)."""
+        async with self._rows_lock:
+            if self._rows is None:
+                # From row 1: the header is always there, so an empty answer means a failed read
+                values = await self.manager.get_all_values_async(self.spreadsheet_id, "Shifts!A1:A")
+                if not values:
+                    return None
+                self._rows = {str(r[0]): i for i, r in enumerate(values[1:], start=2) if r and r[0]}
+            return self._rows
+
+    async def update_shift_end(self, row_num: int, shift: Shift) -> bool:
         if not self.spreadsheet_id or not row_num: return False
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._update_end_sync, row_num, shift_data)
+        end_time = shift.end_time or shift.start_time
+        end_date_str = end_time.strftime("%Y-%m-%d")
+        end_time_str = end_time.strftime("%H:%M:%S")
+        hours = shift.hours or 0
+        status = shift.status or 'OK'
+        
+        # G:I (End Date, End Time, Hours), K (End Geo), M:N (End Video, Status)
+        ranges = [
+            (f"Shifts!G{row_num}:I{row_num}", [[end_date_str, end_time_str, hours]]),
+            (f"Shifts!K{row_num}", [[shift.end_geo or '']]),
+            (f"Shifts!M{row_num}:N{row_num}", [[shift.end_video_path or '', status]])
+        ]
+        
+        # STYLING
+        color = {"red": 0.85, "green": 0.95, "blue": 0.85} # OK (Green)
+        if "MSG" in status or "MESSAGE" in status:
+            color = {"red": 1.0, "green": 1.0, "blue": 0.85} # Message (Yellow)
+        elif "ERROR" in status or "TERMINATED" in status:
+            color = {"red": 1.0, "green": 0.85, "blue": 0.85} # Error (Red)
+        
+        return await self.batcher.update(self.spreadsheet_id, row_num, ranges, color)
 
-    def _update_end_sync(self, row_num: int, shift_data: Dict[str, Any]) -> bool:
-        try:
-            end_time = shift_data.get('end_time') or shift_data.get('start_time')
-            end_date_str = end_time.strftime("%Y-%m-%d")
-            end_time_str = end_time.strftime("%H:%M:%S")
-            hours = shift_data.get('hours', 0)
-            status = shift_data.get('status', 'OK')
-            
-            # G, H, I (End Date, End Time, Hours)
-            self.manager.update_data(self.spreadsheet_id, f"Shifts!G{row_num}:I{row_num}", 
-                                    [[end_date_str, end_time_str, hours]])
-            
-            # K (End Geo)
-            self.manager.update_data(self.spreadsheet_id, f"Shifts!K{row_num}", [[shift_data.get('end_geo', '')]])
-            
-            # M, N (End Video, Status)
-            self.manager.update_data(self.spreadsheet_id, f"Shifts!M{row_num}:N{row_num}", 
-                                    [[shift_data.get('end_video_path', ''), status]])
-            
-            # STYLING
-            color = {"red": 0.85, "green": 0.95, "blue": 0.85} # OK (Green)
-            if "MSG" in status or "MESSAGE" in status:
-                color = {"red": 1.0, "green": 1.0, "blue": 0.85} # Message (Yellow)
-            elif "ERROR" in status or "TERMINATED" in status:
-                color = {"red": 1.0, "green": 0.85, "blue": 0.85} # Error (Red)
-                
-            self.manager.format_row(self.spreadsheet_id, "Shifts", row_num, color)
-            
-            return True
-        except Exception as e:
-            print(f"Update End Error: {e}")
-            return False
+    async def close(self):
+        """Sends whatever is still queued, then closes the HTTP session."""
+        await self.batcher.close()
+        await self.manager.close()
 
-    def _build_row(self, data: Dict[str, Any], status: str) -> List[Any]:
-        start_time = data.get('start_time')
+    def _build_row(self, shift: Shift, status: str) -> List[Any]:
+        start_time = shift.start_time
         start_date = start_time.strftime("%Y-%m-%d") if start_time else ""
         start_clock = start_time.strftime("%H:%M:%S") if start_time else ""
         
-        end_time = data.get('end_time')
+        end_time = shift.end_time
         end_date = end_time.strftime("%Y-%m-%d") if end_time else ""
         end_clock = end_time.strftime("%H:%M:%S") if end_time else ""
         
         return [
-            str(data.get('shift_id', '')),     # A: Event ID
-            str(data.get('user_id', '')),      # B: User ID
-            data.get('user_name', ''),         # C: Worker
-            data.get('project', ''),           # D: Project
+            # A: Event ID. Leading ' keeps USER_ENTERED from turning the
+            # 17-digit ID into a float and rounding it.
+            f"'{shift.shift_id}",
+            str(shift.user_id),                # B: User ID
+            shift.user_name or '',             # C: Worker
+            shift.project or '',               # D: Project
             start_date,                        # E: Start Date
             start_clock,                       # F: Start Time
             end_date,                          # G: End Date
             end_clock,                         # H: End Time
-            data.get('hours', ""),             # I: Work Hours
-            data.get('start_geo', ''),         # J: Start Geo
-            data.get('end_geo', ''),           # K: End Geo
-            data.get('start_video_path', ''),  # L: Start Video
-            data.get('end_video_path', ''),    # M: End Video
-            status if status != "OK" else data.get('status', 'OK'), # N: Status
-            data.get('comment', '')            # O: Comment
+            shift.hours if shift.hours is not None else "", # I: Work Hours
+            shift.start_geo or '',             # J: Start Geo
+            shift.end_geo or '',               # K: End Geo
+            shift.start_video_path or '',      # L: Start Video
+            shift.end_video_path or '',        # M: End Video
+            status if status != "OK" else (shift.status or 'OK'), # N: Status
+            shift.comment or ''                # O: Comment
         ]
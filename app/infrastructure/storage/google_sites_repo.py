@@ -1,48 +1,96 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, FrozenSet, Optional, Tuple
+from app.domain.i_sites import ISitesRepository
 from app.infrastructure.google.sheets_manager import GoogleSheetsManager
 import asyncio
+import time
 
-class GoogleSitesRepository:
-    def __init__(self, manager: GoogleSheetsManager, spreadsheet_id: str):
+class GoogleSitesRepository(ISitesRepository):
+    """
+    Site catalog from the "Sites" sheet, held in memory: one read of Sites!A2:D
+    gives both the menu (names) and a name -> details index.
+    After `ttl` seconds the cached catalog is still served while a refresh runs in
+    the background (stale-while-revalidate); concurrent callers share one fetch.
+    """
+    def __init__(self, manager: GoogleSheetsManager, spreadsheet_id: str, ttl: float = 60):
         self.manager = manager
         self.spreadsheet_id = spreadsheet_id
         # Cache sites to avoid hitting Google API every click
-        self._cache = []
-        self._last_update = 0
-        self._update_interval = 60 # Check every minute? Or just on demand?
+        self._sites: List[str] = []
+        self._site_set: FrozenSet[str] = frozenset()
+        self._details: Dict[str, Dict] = {}
+        self._last_update: Optional[float] = None
+        self._ttl = ttl
+        self._inflight: Optional[asyncio.Task] = None
 
     async def get_all_sites(self) -> List[str]:
-        # Async wrapper for sync google call
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._get_sites_sync)
-
-    def _get_sites_sync(self) -> List[str]:
-        # Format in Sheet "Sites": [Site Name, Lat, Lon, Radius] (from fix_google_sheet.py)
-        # We need Site Name (Column A)
-        
-        rows = self.manager.get_all_values(self.spreadsheet_id, "Sites!A2:A")
-        sites = [row[0] for row in rows if row]
-        return sites
+        await self._ensure_fresh()
+        return self._sites
+
+    async def has_site(self, name: str) -> bool:
+        await self._ensure_fresh()
+        return name in self._site_set
 
     async def get_site_details(self, site_name: str) -> Dict:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._get_site_details_sync, site_name)
+        await self._ensure_fresh()
+        return self._details.get(site_name)
+
+    async def refresh(self):
+        """Forces a re-read (e.g. after the Sites sheet was edited)."""
+        await asyncio.shield(self._fetch())
+
+    async def _ensure_fresh(self):
+        if self._last_update is None:
+            # Nothing to serve yet: wait for the first load. Shielded, so a cancelled
+            # handler doesn't cancel the fetch the other waiters share
+            await asyncio.shield(self._fetch())
+        elif time.monotonic() - self._last_update >= self._ttl:
+            self._fetch() # Serve the stale catalog, refresh behind it
+
+    def _fetch(self) -> asyncio.Task:
+        # One in-flight fetch, shared by everyone who asks meanwhile
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._load())
+        return self._inflight
+
+    async def _load(self):
+        try:
+            # Format in Sheet "Sites": [Site Name, Lat, Lon, Radius] (from fix_google_sheet.py)
+            rows = await self.manager.get_all_values_async(self.spreadsheet_id, "Sites!A2:D")
+            sites, details = self._parse_sites(rows)
+        except Exception as e:
+            print(f"Sites Load Error: {e}")
+            sites, details = None, None
+        now = time.monotonic()
+        if not sites:
+            # Read failed (the manager reports errors as empty): keep what we have and
+            # try again after another ttl; with nothing loaded yet, the next caller retries
+            self._last_update = now if self._last_update is not None else None
+            return
+        # Replace, don't mutate: callers may still hold the previous list
+        self._sites = sites
+        self._site_set = frozenset(sites)
+        self._details = details
+        self._last_update = now
 
-    def _get_site_details_sync(self, site_name: str) -> Dict:
-        rows = self.manager.get_all_values(self.spreadsheet_id, "Sites!A2:D")
+    @staticmethod
+    def _parse_sites(rows: List[List[str]]) -> Tuple[List[str], Dict[str, Dict]]:
+        sites = []
+        details = {}
         for row in rows:
-            if len(row) > 0 and row[0] == site_name:
-                # [Name, Lat, Lon, Radius]
-                try:
-                    return {
-                        "name": row[0],
-                        "lat": float(row[1]) if len(row) > 1 else 0.0,
-                        "lon": float(row[2]) if len(row) > 2 else 0.0,
-                        "radius": int(row[3]) if len(row) > 3 else 500
-                    }
-                except:
-                    pass
-        return None
+            if not row or not row[0]:
+                continue
+            sites.append(row[0])
+            # [Name, Lat, Lon, Radius]
+            try:
+                details[row[0]] = {
+                    "name": row[0],
+                    "lat": float(row[1]) if len(row) > 1 else 0.0,
+                    "lon": float(row[2]) if len(row) > 2 else 0.0,
+                    "radius": int(row[3]) if len(row) > 3 else 500
+                }
+            except:
+                pass
+        return sites, details
 
     # Implement other methods if interface requires
     async def add_site(self, name: str, lat: float, lon: float, radius: int) -> bool:
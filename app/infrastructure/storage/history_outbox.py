@@ -0,0 +1,257 @@
+import asyncio
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from app.domain.shift import Shift
+from app.domain.i_storage import EVENT_START, EVENT_END, EVENT_COMPLETE
+from app.infrastructure.storage.sqlite_connection import SqliteConnectionPool
+from app.infrastructure.storage.sqlite_migrations import apply_migrations
+from app.infrastructure.storage.db_executor import DbExecutor, get_db_executor
+
+MIGRATIONS = [
+    (1, ["""
+        CREATE TABLE IF NOT EXISTS history_outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            shift_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS outbox_cursors (
+            backend TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS outbox_rows (
+            backend TEXT NOT NULL,
+            shift_id TEXT NOT NULL,
+            row_num INTEGER NOT NULL,
+            PRIMARY KEY (backend, shift_id)
+        )
+    """,
+        "CREATE INDEX IF NOT EXISTS idx_history_outbox_created ON history_outbox (created_at)",
+    ]),
+]
+
+# (seq, kind, shift)
+OutboxEvent = Tuple[int, str, Shift]
+# (backend, seq, kind, shift_id, row_num)
+OutboxAck = Tuple[str, int, str, str, Optional[int]]
+
+class HistoryOutbox:
+    """
+    SQLite outbox for history events. Events are inserted in the caller's transaction,
+    so an event exists if and only if the state change that caused it committed.
+    Each backend has its own cursor (last delivered seq); rows a backend assigned
+    (e.g. the Google Sheets row of a started shift) are kept until the shift's end is delivered.
+    """
+    def __init__(self, pool: SqliteConnectionPool):
+        self.pool = pool
+        apply_migrations(self.pool, "history_outbox", MIGRATIONS)
+
+    def enqueue(self, conn: sqlite3.Connection, kind: str, shift: Shift) -> int:
+        """Adds an event inside an open transaction (see SqliteStateStorage)."""
+        cur = conn.execute(
+            "INSERT INTO history_outbox (kind, shift_id, payload, created_at) VALUES (?, ?, ?, ?)",
+            (kind, shift.shift_id, json.dumps(shift.to_payload(), ensure_ascii=False, default=str), datetime.now())
+        )
+        return cur.lastrowid
+
+    def cursors(self, backends: List[str]) -> Dict[str, int]:
+        conn = self.pool.connection()
+        known = dict(conn.execute("SELECT backend, seq FROM outbox_cursors").fetchall())
+        return {b: known.get(b, 0) for b in backends}
+
+    def pending(self, after_seq: int, limit: int = 100) -> List[OutboxEvent]:
+        rows = self.pool.connection().execute(
+            "SELECT seq, kind, payload FROM history_outbox WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, limit)
+        ).fetchall()
+        return [(r[0], r[1], Shift.from_payload(json.loads(r[2]))) for r in rows]
+
+    def rows_for(self, shift_ids: List[str]) -> Dict[Tuple[str, str], int]:
+        if not shift_ids:
+            return {}
+        marks = ",".join("?" * len(shift_ids))
+        rows = self.pool.connection().execute(
+            f"SELECT backend, shift_id, row_num FROM outbox_rows WHERE shift_id IN ({marks})", shift_ids
+        ).fetchall()
+        return {(r[0], r[1]): r[2] for r in rows}
+
+    def acknowledge(self, acks: List[OutboxAck], cursors: Dict[str, int] = None):
+        """
+        Records the rows delivered events assigned (or released) and advances cursors,
+        in one transaction. Without `cursors`, each ack moves its backend's cursor to its seq.
+        """
+        if cursors is None:
+            cursors = {}
+            for backend, seq, _, _, _ in acks:
+                cursors[backend] = max(cursors.get(backend, 0), seq)
+        with self.pool.transaction() as conn:
+            for backend, seq, kind, shift_id, row_num in acks:
+                if kind == EVENT_START and row_num:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO outbox_rows (backend, shift_id, row_num) VALUES (?, ?, ?)",
+                        (backend, shift_id, row_num)
+                    )
+                elif kind in (EVENT_END, EVENT_COMPLETE):
+                    conn.execute("DELETE FROM outbox_rows WHERE backend = ? AND shift_id = ?", (backend, shift_id))
+            for backend, seq in cursors.items():
+                conn.execute("""
+                    INSERT INTO outbox_cursors (backend, seq) VALUES (?, ?)
+                    ON CONFLICT(backend) DO UPDATE SET seq = MAX(seq, excluded.seq)
+                """, (backend, seq))
+
+    def prune(self, backends: List[str], retention_days: int = 30) -> int:
+        """
+        Drops events every one of `backends` has received; a backend that never acknowledged
+        anything counts as seq 0. Events older than `retention_days` go regardless, so a
+        backend that is down for good doesn't pin the table.
+        """
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        with self.pool.transaction() as conn:
+            known = dict(conn.execute("SELECT backend, seq FROM outbox_cursors").fetchall())
+            delivered = min((known.get(b, 0) for b in backends), default=0)
+            return conn.execute(
+                "DELETE FROM history_outbox WHERE seq <= ? OR created_at < ?", (delivered, cutoff)
+            ).rowcount
+
+class OutboxDispatcher:
+    """
+    Drains the outbox to the history backends through CompositeHistoryStorage, one lane
+    per backend, so a slow backend never holds up another. A lane takes `batch_size`
+    pending events at a time and delivers them concurrently, one chain per shift (a shift's
+    events stay in order); that is what lets the Sheets write batcher merge a check-in wave
+    into a few API calls. A failed event stops its shift's chain; the lane's cursor only
+    moves over a contiguous run of delivered events, and the lane retries after
+    `retry_interval`. Events queued on an async mirror count once the mirror reports them applied.
+    Delivery is at-least-once: a crash before the cursor moves replays those events on restart
+    (Excel upserts by Event ID, Google looks the Event ID up before appending, end patches
+    target the recorded row).
+    """
+    def __init__(self, outbox: HistoryOutbox, history, executor: DbExecutor = None,
+                 batch_size: int = 100, retry_interval: float = 30.0, prune_interval: float = 3600):
+        self.outbox = outbox
+        self.history = history # CompositeHistoryStorage
+        self.executor = executor or get_db_executor(outbox.pool)
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.prune_interval = prune_interval
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Per backend, seqs past the stored cursor: delivered (cursor catches up over them)
+        # and handed to an async mirror (not yet applied). Neither is sent again.
+        self._done: Dict[str, Set[int]] = {}
+        self._queued: Dict[str, Set[int]] = {}
+        if hasattr(history, "on_replicated"):
+            history.on_replicated = self._on_replicated
+            history.on_dropped = self._on_dropped
+
+    def start(self):
+        """Starts draining (also replays whatever was left undelivered before a restart)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        """Called after an event committed: deliver it now instead of at the next retry."""
+        self._wake.set()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.drain()
+        except Exception as e:
+            print(f"Outbox Dispatch Error: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_prune = loop.time()
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain()
+                if loop.time() - last_prune >= self.prune_interval:
+                    last_prune = loop.time()
+                    await self.executor.write(self.outbox.prune, self.history.names())
+            except Exception as e:
+                print(f"Outbox Dispatch Error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _on_replicated(self, backend: str, seq: int, kind: str, shift_id: str, row_num: Optional[int]):
+        # Rows now; the cursor moves on the lane's next pass, once everything before seq is in too
+        try:
+            await self.executor.write(self.outbox.acknowledge, [(backend, seq, kind, shift_id, row_num)], {})
+        except Exception:
+            # Not recorded: let the next pass send it again rather than wait for it forever
+            self._queued.setdefault(backend, set()).discard(seq)
+            raise
+        self._queued.setdefault(backend, set()).discard(seq)
+        self._done.setdefault(backend, set()).add(seq)
+
+    def _on_dropped(self, backend: str, seq: int):
+        # The mirror gave up: the next pass sends it again
+        self._queued.setdefault(backend, set()).discard(seq)
+
+    async def drain(self) -> bool:
+        """Delivers pending events; True if every backend is caught up."""
+        backends = self.history.names()
+        cursors = await self.executor.read(self.outbox.cursors, backends)
+        results = await asyncio.gather(*(self._drain_backend(b, cursors[b]) for b in backends))
+        return all(results)
+
+    async def _drain_backend(self, backend: str, cursor: int) -> bool:
+        done = self._done.setdefault(backend, set())
+        queued = self._queued.setdefault(backend, set())
+        position = cursor # Read position: past the cursor while a mirror still holds events
+        while True:
+            events = await self.executor.read(self.outbox.pending, position, self.batch_size)
+            if not events:
+                return not queued
+            todo = [e for e in events if e[0] not in done and e[0] not in queued]
+            rows = await self.executor.read(self.outbox.rows_for, list({e[2].shift_id for e in todo}))
+            chains: Dict[str, List[OutboxEvent]] = {}
+            for event in todo:
+                chains.setdefault(event[2].shift_id, []).append(event)
+            acks: List[OutboxAck] = []
+            outcomes = await asyncio.gather(*(
+                self._deliver_chain(backend, chain, rows, acks) for chain in chains.values()
+            ))
+            # Stored cursor: last seq with everything up to it delivered. Once a mirror
+            # holds events behind us (position > cursor), it waits for the next pass.
+            if position == cursor:
+                for seq, _, _ in events:
+                    if seq not in done:
+                        break
+                    cursor = seq
+            done.difference_update([seq for seq in done if seq <= cursor])
+            if acks or cursor > position:
+                await self.executor.write(self.outbox.acknowledge, acks, {backend: cursor})
+            if not all(outcomes):
+                return False # Retried after retry_interval, from the stored cursor
+            position = events[-1][0]
+
+    async def _deliver_chain(self, backend: str, chain: List[OutboxEvent],
+                             rows: Dict[Tuple[str, str], int], acks: List[OutboxAck]) -> bool:
+        """Delivers one shift's events in order; False (and stops) at the first failure."""
+        done = self._done[backend]
+        for seq, kind, shift in chain:
+            ok, row_num = await self.history.dispatch(
+                backend, kind, shift, rows.get((backend, shift.shift_id)), seq
+            )
+            if ok is None:
+                self._queued[backend].add(seq) # Mirror applies it later, see _on_replicated
+                continue
+            if not ok:
+                return False
+            done.add(seq)
+            if row_num:
+                rows[(backend, shift.shift_id)] = row_num # The shift's end patches this row
+            acks.append((backend, seq, kind, shift.shift_id, row_num))
+        return True
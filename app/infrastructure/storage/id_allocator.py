@@ -0,0 +1,36 @@
+import sqlite3
+from datetime import datetime
+from app.infrastructure.storage.sqlite_connection import SqliteConnectionPool
+from app.infrastructure.storage.sqlite_migrations import apply_migrations
+
+MIGRATIONS = [
+    (1, ["""
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """]),
+]
+
+class IdAllocator:
+    """
+    Issues unique, monotonic, time-sortable IDs like 20261017071503123
+    (local time down to milliseconds). If the clock hasn't moved, or went back,
+    the previous value is bumped by one, so IDs never repeat.
+    Must be called inside the caller's write transaction: BEGIN IMMEDIATE
+    serializes concurrent allocations, and a rolled-back insert gives its ID back.
+    """
+    def __init__(self, pool: SqliteConnectionPool, sequence: str = "shift"):
+        self.sequence = sequence
+        apply_migrations(pool, "id_sequences", MIGRATIONS)
+
+    def allocate(self, conn: sqlite3.Connection, now: datetime = None) -> str:
+        now = now or datetime.now()
+        candidate = int(now.strftime("%Y%m%d%H%M%S") + f"{now.microsecond // 1000:03d}")
+        row = conn.execute("SELECT value FROM id_sequences WHERE name = ?", (self.sequence,)).fetchone()
+        value = max(candidate, row[0] + 1) if row else candidate
+        conn.execute("""
+            INSERT INTO id_sequences (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value
+        """, (self.sequence, value))
+        return str(value)
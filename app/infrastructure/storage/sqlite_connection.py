@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+def _convert_timestamp(raw: bytes):
+    text = raw.decode()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return text # Legacy/hand-edited value: hand back as-is
+
+# Timestamps are decoded once, by the driver, for every column declared TIMESTAMP
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+sqlite3.register_converter("BOOLEAN", lambda raw: raw not in (b"0", b""))
+
+class SqliteConnectionPool:
+    """
+    Long-lived SQLite connections shared by all components using the same DB file.
+    One connection per thread (sqlite3 connections are not thread-safe), opened once
+    in WAL mode so readers never block the writer. Statements are compiled once per
+    connection and reused through sqlite3's statement cache.
+    """
+    def __init__(self, db_file: str, cache_size_kib: int = 8192, busy_timeout: float = 5.0,
+                 cached_statements: int = 256):
+        self.db_file = db_file
+        self.cache_size_kib = cache_size_kib
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: we manage transactions explicitly in transaction()
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            detect_types=sqlite3.PARSE_DECLTYPES
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # Durable in WAL, no fsync per commit
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Commits on success, rolls back on error.
+        Nested calls become savepoints, so a failing inner block doesn't abort the outer one.
+        """
+        conn = self.connection()
+        depth = self._local.depth
+        if depth == 0:
+            # IMMEDIATE takes the write lock up front: no SQLITE_BUSY on lock upgrade
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        else:
+            conn.execute(f"SAVEPOINT sp_{depth}")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute(f"ROLLBACK TO sp_{depth}")
+                conn.execute(f"RELEASE sp_{depth}")
+            raise
+        self._local.depth = depth
+        if depth == 0:
+            conn.execute("COMMIT")
+        else:
+            conn.execute(f"RELEASE sp_{depth}")
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+_pools: Dict[str, SqliteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_file: str) -> SqliteConnectionPool:
+    """Shared pool per DB file, so every storage on bot_database.db reuses the same connections."""
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = SqliteConnectionPool(db_file)
+            _pools[db_file] = pool
+        return pool
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from app.infrastructure.storage.sqlite_connection import get_pool
+from app.infrastructure.storage.sqlite_migrations import apply_migrations
+from app.infrastructure.storage.db_executor import get_db_executor
+
+MIGRATIONS = [
+    (1, ["""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        )
+    """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)",
+    ]),
+]
+
+class _Entry:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], touched: float):
+        self.state = state
+        self.data = data
+        self.touched = touched
+
+class SqliteFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage on bot_database.db, so users keep their place in a flow across restarts.
+    Reads are served from a bounded LRU cache; changes are collected and written in one
+    transaction every `flush_interval` seconds (or once `max_dirty` keys changed).
+    Flows untouched for `ttl` seconds are treated as abandoned and evicted.
+    """
+    def __init__(self, db_file: str, ttl: float = 24 * 3600, max_cached: int = 1000,
+                 flush_interval: float = 2.0, max_dirty: int = 100, evict_interval: float = 600):
+        self.pool = get_pool(db_file)
+        self.executor = get_db_executor(self.pool)
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.evict_interval = evict_interval
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: Dict[str, _Entry] = {} # pending writes, newest snapshot per key
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        apply_migrations(self.pool, "fsm_states", MIGRATIONS)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            getattr(key, "business_connection_id", None), key.destiny
+        ))
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(self._key(key))
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(self._key(key), entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(self._key(key))
+        entry.data = dict(data)
+        self._touch(self._key(key), entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(self._key(key))).data)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    # --- Cache ---
+
+    async def _entry(self, skey: str) -> _Entry:
+        self._ensure_task()
+        now = time.time()
+        entry = self._cache.get(skey) or self._dirty.get(skey)
+        if entry is None:
+            row = await self.executor.read(self._load_sync, skey)
+            entry = self._cache.get(skey) or self._dirty.get(skey) # may have changed while we waited
+            if entry is None:
+                entry = _Entry(*row) if row else _Entry(None, {}, now)
+        if now - entry.touched > self.ttl:
+            entry = _Entry(None, {}, now) # Abandoned flow: start over
+        self._cache[skey] = entry
+        self._cache.move_to_end(skey)
+        self._shrink()
+        return entry
+
+    def _touch(self, skey: str, entry: _Entry):
+        entry.touched = time.time()
+        self._dirty[skey] = entry
+        if len(self._dirty) >= self.max_dirty:
+            asyncio.create_task(self.flush())
+
+    def _shrink(self):
+        # Evicting a dirty entry is safe: it's still readable from _dirty until flushed
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    # --- Persistence ---
+
+    def _ensure_task(self):
+        if self._task is None and not self._closed:
+            self._task = asyncio.create_task(self._background())
+
+    async def _background(self):
+        last_evict = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_evict >= self.evict_interval:
+                    last_evict = time.monotonic()
+                    await self.evict_expired()
+            except Exception as e:
+                print(f"FSM Storage Error: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            rows = [(k, e.state, json.dumps(e.data, default=str), e.touched) for k, e in batch.items()]
+            try:
+                await self.executor.write(self._write_sync, rows)
+            except Exception:
+                # Put back whatever wasn't overwritten meanwhile, retry next round
+                for k, e in batch.items():
+                    self._dirty.setdefault(k, e)
+                raise
+
+    async def evict_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        for skey in [k for k, e in self._cache.items() if e.touched < cutoff and k not in self._dirty]:
+            del self._cache[skey]
+        return await self.executor.write(self._evict_sync, cutoff)
+
+    def _load_sync(self, skey: str) -> Optional[Tuple[Optional[str], Dict[str, Any], float]]:
+        row = self.pool.connection().execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (skey,)
+        ).fetchone()
+        if not row:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else {}, row[2]
+
+    def _write_sync(self, rows: List[Tuple[str, Optional[str], str, float]]):
+        with self.pool.transaction() as conn:
+            # Finished flows (no state, no data) are simply deleted
+            conn.executemany(
+                "DELETE FROM fsm_states WHERE key = ?",
+                [(r[0],) for r in rows if r[1] is None and r[2] == "{}"]
+            )
+            conn.executemany("""
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                    updated_at = excluded.updated_at
+            """, [r for r in rows if not (r[1] is None and r[2] == "{}")])
+
+    def _evict_sync(self, cutoff: float) -> int:
+        with self.pool.transaction() as conn:
+            return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,)).rowcount
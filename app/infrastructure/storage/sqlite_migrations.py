@@ -0,0 +1,36 @@
+from typing import List, Tuple
+from app.infrastructure.storage.sqlite_connection import SqliteConnectionPool
+
+# (version, statements). Versions are per component and only ever appended.
+Migration = Tuple[int, List[str]]
+
+def apply_migrations(pool: SqliteConnectionPool, component: str, migrations: List[Migration]) -> int:
+    """
+    Brings one component's tables up to the latest version, in place.
+    Several components share bot_database.db, so versions are tracked per component
+    in `schema_versions` rather than in PRAGMA user_version.
+    Returns the resulting schema version.
+    """
+    with pool.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_versions (
+                component TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+        row = conn.execute("SELECT version FROM schema_versions WHERE component = ?", (component,)).fetchone()
+        current = row[0] if row else 0
+
+        for version, statements in sorted(migrations, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            # Each step is a savepoint: a broken step leaves the previous version intact
+            with pool.transaction():
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(
+                    "INSERT OR REPLACE INTO schema_versions (component, version) VALUES (?, ?)",
+                    (component, version)
+                )
+            current = version
+    return current
@@ -1,110 +1,177 @@
 import sqlite3
-import uuid
 from datetime import datetime
 from typing import Dict, Any, Optional, List
-from app.domain.i_storage import IStateStorage
+from app.domain.i_storage import IStateStorage, HistoryEvent
+from app.domain.shift import Shift
+from app.infrastructure.storage.sqlite_connection import get_pool
+from app.infrastructure.storage.sqlite_migrations import apply_migrations
+from app.infrastructure.storage.id_allocator import IdAllocator
+from app.infrastructure.storage.history_outbox import HistoryOutbox
+
+MIGRATIONS = [
+    (1, ["""
+        CREATE TABLE IF NOT EXISTS active_shifts (
+            shift_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            start_time TIMESTAMP,
+            project TEXT,
+            start_geo TEXT,
+            start_video_id TEXT,
+            status TEXT,
+            start_video_path TEXT,
+            sheet_row INTEGER,
+            end_time TIMESTAMP,
+            end_geo TEXT,
+            end_video_id TEXT,
+            comment TEXT,
+            is_active BOOLEAN DEFAULT 1
+        )
+    """]),
+    # Partial index: only in-flight rows, serves get_active_shift and the stale scan.
+    # Covering index: per-user history without touching the table.
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_active_shifts_live ON active_shifts (user_id) WHERE is_active = 1",
+        "CREATE INDEX IF NOT EXISTS idx_active_shifts_user_history "
+        "ON active_shifts (user_id, start_time, shift_id, project, status)",
+    ]),
+    # Cold storage: closed shifts leave active_shifts, which then holds only in-flight rows
+    (3, ["""
+        CREATE TABLE IF NOT EXISTS shift_history (
+            shift_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            start_time TIMESTAMP,
+            project TEXT,
+            start_geo TEXT,
+            start_video_id TEXT,
+            status TEXT,
+            start_video_path TEXT,
+            sheet_row INTEGER,
+            end_time TIMESTAMP,
+            end_geo TEXT,
+            end_video_id TEXT,
+            comment TEXT,
+            is_active BOOLEAN DEFAULT 0,
+            archived_at TIMESTAMP
+        )
+    """,
+        "CREATE INDEX IF NOT EXISTS idx_shift_history_user ON shift_history (user_id, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_shift_history_start ON shift_history (start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_shift_history_project ON shift_history (project, start_time)",
+    ]),
+    # Per-user history is read from shift_history now: move the covering index there
+    # (its (user_id, start_time) prefix also replaces idx_shift_history_user)
+    (4, [
+        "DROP INDEX IF EXISTS idx_active_shifts_user_history",
+        "DROP INDEX IF EXISTS idx_shift_history_user",
+        "CREATE INDEX IF NOT EXISTS idx_shift_history_user_history "
+        "ON shift_history (user_id, start_time, shift_id, project, status)",
+    ]),
+]
+
+SHIFT_COLUMNS = (
+    "shift_id, user_id, start_time, project, start_geo, start_video_id, status, "
+    "start_video_path, sheet_row, end_time, end_geo, end_video_id, comment, is_active"
+)
 
 class SqliteStateStorage(IStateStorage):
     def __init__(self, db_file: str):
         self.db_file = db_file
+        self.pool = get_pool(db_file)
         self._init_db()
+        self.ids = IdAllocator(self.pool)
+        self.outbox = HistoryOutbox(self.pool)
 
     def _init_db(self):
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS active_shifts (
-                    shift_id TEXT PRIMARY KEY,
-                    user_id INTEGER,
-                    start_time TIMESTAMP,
-                    project TEXT,
-                    start_geo TEXT,
-                    start_video_id TEXT,
-                    status TEXT,
-                    start_video_path TEXT,
-                    sheet_row INTEGER,
-                    end_time TIMESTAMP,
-                    end_geo TEXT,
-                    end_video_id TEXT,
-                    comment TEXT,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            """)
-            conn.commit()
+        apply_migrations(self.pool, "active_shifts", MIGRATIONS)
 
-    def create_shift(self, user_id: int) -> str:
-        """Creates a new shift record and returns its sequential ID."""
+    def create_shift(self, user_id: int) -> Optional[str]:
+        """Creates a new shift record and returns its time-sortable ID (None if one is already active)."""
         start_time = datetime.now()
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            # Find next sequential ID
-            # Better: use MAX(CAST(shift_id as INTEGER)) if they are numeric
-            try:
-                cursor.execute("SELECT COUNT(*) FROM active_shifts")
-                count = cursor.fetchone()[0]
-                new_id = str(count + 1)
-            except:
-                new_id = "1"
-
-            cursor.execute("""
+        with self.pool.transaction() as conn:
+            # Checked under the write lock: a double tap can't create two active shifts
+            if conn.execute(
+                "SELECT 1 FROM active_shifts WHERE user_id = ? AND is_active = 1 LIMIT 1", (user_id,)
+            ).fetchone():
+                return None
+            # Issued in the same transaction as the insert
+            new_id = self.ids.allocate(conn, start_time)
+            conn.execute("""
                 INSERT INTO active_shifts (shift_id, user_id, status, start_time, is_active)
                 VALUES (?, ?, ?, ?, 1)
             """, (new_id, user_id, 'init', start_time))
-            conn.commit()
             return new_id
 
-    def update_shift(self, shift_id: str, data: Dict[str, Any]):
-        """Updates fields dynamically."""
-        if not data: return
+    def allocate_event_id(self) -> str:
+        """ID for history events that have no shift row (e.g. manager messages)."""
+        with self.pool.transaction() as conn:
+            return self.ids.allocate(conn)
+
+    def update_shift(self, shift_id: str, data: Dict[str, Any], event: Optional[HistoryEvent] = None):
+        """Updates fields dynamically. `event` goes to the history outbox in the same transaction."""
+        if not data:
+            if event:
+                self.record_event(*event)
+            return
         set_clause = []
         values = []
-        for key, value in data.items():
+        # Sorted keys keep the SQL text stable, so the prepared statement is reused
+        for key in sorted(data):
             set_clause.append(f"{key} = ?")
-            values.append(value)
+            values.append(data[key])
         values.append(shift_id)
         
         sql = f"UPDATE active_shifts SET {', '.join(set_clause)} WHERE shift_id = ?"
         
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, values)
-            conn.commit()
+        with self.pool.transaction() as conn:
+            conn.execute(sql, values)
+            # Closing a shift moves it to shift_history in the same transaction
+            if "is_active" in data and not data["is_active"]:
+                self._archive(conn, [shift_id])
+            if event:
+                self.outbox.enqueue(conn, *event)
 
-    def get_active_shift(self, user_id: int) -> Optional[Dict[str, Any]]:
-        with sqlite3.connect(self.db_file) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM active_shifts WHERE user_id = ? AND is_active = 1", (user_id,))
-            row = cursor.fetchone()
-            
-        if row:
-            d = dict(row)
-            # Parse datetime
-            if isinstance(d['start_time'], str):
-                try: d['start_time'] = datetime.fromisoformat(d['start_time'])
-                except: pass
-            return d
-        return None
+    def record_event(self, kind: str, shift: Shift):
+        """History event with no state change behind it (e.g. a manager message)."""
+        with self.pool.transaction() as conn:
+            self.outbox.enqueue(conn, kind, shift)
 
-    def get_all_active_shifts(self) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_file) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM active_shifts WHERE is_active = 1")
-            rows = cursor.fetchall()
-        
-        results = []
-        for row in rows:
-             d = dict(row)
-             if isinstance(d['start_time'], str):
-                try: d['start_time'] = datetime.fromisoformat(d['start_time'])
-                except: pass
-             results.append(d)
-        return results
+    def get_active_shift(self, user_id: int) -> Optional[Shift]:
+        conn = self.pool.connection()
+        row = conn.execute(
+            f"SELECT {SHIFT_COLUMNS} FROM active_shifts WHERE user_id = ? AND is_active = 1", (user_id,)
+        ).fetchone()
+        return Shift.from_row(row) if row else None
+
+    def get_all_active_shifts(self) -> List[Shift]:
+        conn = self.pool.connection()
+        rows = conn.execute(f"SELECT {SHIFT_COLUMNS} FROM active_shifts WHERE is_active = 1").fetchall()
+        return [Shift.from_row(row) for row in rows]
 
     def remove_active_shift(self, user_id: int) -> bool:
-         with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE active_shifts SET is_active = 0 WHERE user_id = ? AND is_active = 1", (user_id,))
-            conn.commit()
-         return True
+        with self.pool.transaction() as conn:
+            rows = conn.execute("SELECT shift_id FROM active_shifts WHERE user_id = ? AND is_active = 1", (user_id,)).fetchall()
+            conn.execute("UPDATE active_shifts SET is_active = 0 WHERE user_id = ? AND is_active = 1", (user_id,))
+            self._archive(conn, [r[0] for r in rows])
+        return True
+
+    def archive_closed_shifts(self, batch_size: int = 500) -> int:
+        """Sweeps leftover closed rows (e.g. from older versions) into shift_history, batch by batch."""
+        total = 0
+        while True:
+            with self.pool.transaction() as conn:
+                rows = conn.execute(
+                    "SELECT shift_id FROM active_shifts WHERE is_active = 0 LIMIT ?", (batch_size,)
+                ).fetchall()
+                if not rows:
+                    return total
+                self._archive(conn, [r[0] for r in rows])
+            total += len(rows)
+
+    def _archive(self, conn: sqlite3.Connection, shift_ids: List[str]):
+        if not shift_ids: return
+        marks = ", ".join("?" * len(shift_ids))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO shift_history ({SHIFT_COLUMNS}, archived_at)
+            SELECT {SHIFT_COLUMNS}, ? FROM active_shifts WHERE shift_id IN ({marks}) AND is_active = 0
+        """, (datetime.now(), *shift_ids))
+        conn.execute(f"DELETE FROM active_shifts WHERE shift_id IN ({marks}) AND is_active = 0", shift_ids)
@@ -27,7 +27,7 @@ async def command_start(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Check Registration
-    if not _controller.is_user_registered(user_id):
+    if not await _controller.is_user_registered(user_id):
         await message.answer(
             f"Привет, {html.bold(message.from_user.full_name)}! 👋\n"
             "Для начала работы нужно зарегистрироваться.\n"
@@ -37,7 +37,7 @@ async def command_start(message: Message, state: FSMContext):
         await state.set_state(RegistrationStates.waiting_for_name)
         return
 
-    active_shift = _controller.get_active_shift(user_id)
+    active_shift = await _controller.get_active_shift(user_id)
     await message.answer(
         "Добро пожаловать в систему учёта времени.",
         reply_markup=get_main_menu_keyboard(bool(active_shift))
@@ -56,7 +56,7 @@ async def process_reg_phone(message: Message, state: FSMContext):
     full_name = data['full_name']
     phone = message.contact.phone_number
     
-    _controller.register_user(message.from_user.id, message.from_user.username, full_name, phone)
+    await _controller.register_user(message.from_user.id, message.from_user.username, full_name, phone)
     
     await state.clear()
     await message.answer("Регистрация успешна! ✅\nТеперь вы можете начать работу.", reply_markup=get_main_menu_keyboard(False))
@@ -77,13 +77,13 @@ async def process_cancel(message: Message, state: FSMContext):
     # but for UI user needs to reset.
     await state.clear()
     user_id = message.from_user.id
-    active_shift = _controller.get_active_shift(user_id)
+    active_shift = await _controller.get_active_shift(user_id)
     await message.answer("Действие отменено.", reply_markup=get_main_menu_keyboard(bool(active_shift)))
 
 @router.message(F.text == "Мой профиль")
 async def process_profile(message: Message):
     user_id = message.from_user.id
-    user = _controller.user_manager.get_user(user_id)
+    user = await _controller.get_user(user_id)
     if not user:
         await message.answer("Профиль не найден. Нажмите /start для регистрации.")
         return
@@ -101,15 +101,15 @@ async def start_shift_btn(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Strict Registration Check
-    if not _controller.is_user_registered(user_id):
+    if not await _controller.is_user_registered(user_id):
         await message.answer("⚠️ Вы не зарегистрированы. Введите /start")
         return
 
-    active_shift = _controller.get_active_shift(user_id)
+    active_shift = await _controller.get_active_shift(user_id)
     
     if active_shift:
-        project = active_shift['project'] or "Не выбран"
-        start_time = active_shift['start_time'].strftime("%H:%M")
+        project = active_shift.project or "Не выбран"
+        start_time = active_shift.start_time.strftime("%H:%M")
         
         await message.answer(
             f"❌ <b>Смена уже активна!</b>\n\n"
@@ -121,7 +121,7 @@ async def start_shift_btn(message: Message, state: FSMContext):
         return
     
     # Init Record
-    if not _controller.init_shift(user_id):
+    if not await _controller.init_shift(user_id):
         await message.answer("Ошибка создания смены.")
         return
 
@@ -131,12 +131,12 @@ async def start_shift_btn(message: Message, state: FSMContext):
 
 @router.message(StartShiftStates.waiting_for_site)
 async def process_site(message: Message, state: FSMContext):
-    sites = await _controller.get_available_sites()
-    if message.text not in sites:
+    if not await _controller.is_known_site(message.text):
+        sites = await _controller.get_available_sites()
         await message.answer("Выберите объект из меню.", reply_markup=get_sites_keyboard(sites))
         return
     
-    _controller.set_shift_site(message.from_user.id, message.text)
+    await _controller.set_shift_site(message.from_user.id, message.text)
     
     await message.answer("Отправьте геолокацию.", reply_markup=get_geo_keyboard())
     await state.set_state(StartShiftStates.waiting_for_geo)
@@ -144,7 +144,7 @@ async def process_site(message: Message, state: FSMContext):
 @router.message(StartShiftStates.waiting_for_geo, F.location)
 async def process_start_geo(message: Message, state: FSMContext):
     geo = f"{message.location.latitude},{message.location.longitude}"
-    _controller.set_shift_start_geo(message.from_user.id, geo)
+    await _controller.set_shift_start_geo(message.from_user.id, geo)
     
     await message.answer("Геолокация принята. Отправьте видео.", reply_markup=get_cancel_keyboard())
     await state.set_state(StartShiftStates.waiting_for_video)
@@ -163,11 +163,11 @@ async def process_start_video(message: Message, state: FSMContext):
     msg = await message.answer("⏳ Смена началась. Видео загружается в облако...")
     video_link = None
     
-    shift = _controller.get_active_shift(user_id)
+    shift = await _controller.get_active_shift(user_id)
     if shift and _video_service:
         try:
             from datetime import datetime
-            shift_id = shift['shift_id']
+            shift_id = shift.shift_id
             date_str = datetime.now().strftime("%Y-%m-%d")
             filename = f"{shift_id}_start_{date_str}.mp4"
             
@@ -175,25 +175,25 @@ async def process_start_video(message: Message, state: FSMContext):
         except Exception as e:
             await message.answer(f"⚠️ Ошибка загрузки видео: {e}")
             
-    # 2. Set Status (and Log to Sheets)
+    # 2. Set Status (the Sheets log follows from the outbox)
     await _controller.set_shift_start_video(user_id, stored_id, video_link)
     
     await msg.delete()
     await state.clear()
     
     # Get ID again or just generate from start_time? Not needed.
-    await message.answer("✅ Смена успешно начата!\nДанные сохранены в таблице.", reply_markup=get_main_menu_keyboard(True))
+    await message.answer("✅ Смена успешно начата!\nДанные записаны и будут переданы в таблицу.", reply_markup=get_main_menu_keyboard(True))
 
 # --- END SHIFT ---
 @router.message(F.text.in_({"Завершить работу", "Завершить смену"}))
 async def end_shift_btn(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
-    if not _controller.is_user_registered(user_id):
+    if not await _controller.is_user_registered(user_id):
         await message.answer("⚠️ Вы не зарегистрированы. Введите /start")
         return
 
-    if not _controller.get_active_shift(user_id):
+    if not await _controller.get_active_shift(user_id):
         await message.answer("Нет активной смены.", reply_markup=get_main_menu_keyboard(False))
         return
 
@@ -203,7 +203,7 @@ async def end_shift_btn(message: Message, state: FSMContext):
 @router.message(EndShiftStates.waiting_for_geo, F.location)
 async def process_end_geo(message: Message, state: FSMContext):
     geo = f"{message.location.latitude},{message.location.longitude}"
-    _controller.set_shift_end_geo(message.from_user.id, geo)
+    await _controller.set_shift_end_geo(message.from_user.id, geo)
     
     await message.answer("Отправьте финальное видео.", reply_markup=get_cancel_keyboard())
     await state.set_state(EndShiftStates.waiting_for_video)
@@ -230,7 +230,7 @@ async def process_end_video(message: Message, state: FSMContext):
     async def finalize_in_background():
         try:
             # Get shift data to upload start video too
-            shift = _controller.get_active_shift(user_id)
+            shift = await _controller.get_active_shift(user_id)
             
             # Upload videos to Drive if service available
             start_video_link = None
@@ -238,11 +238,11 @@ async def process_end_video(message: Message, state: FSMContext):
             
             if _video_service and shift:
                 from datetime import datetime
-                shift_id = shift.get('shift_id', 'unknown')
+                shift_id = shift.shift_id
                 date_str = datetime.now().strftime("%Y-%m-%d")
 
                 # Upload start video
-                start_vid_parts = shift.get('start_video_id', '').split('|')
+                start_vid_parts = (shift.start_video_id or '').split('|')
                 if len(start_vid_parts) >= 2:
                     start_file_id = start_vid_parts[0]
                     start_filename = f"{shift_id}_start_{date_str}.mp4"
@@ -263,9 +263,9 @@ async def process_end_video(message: Message, state: FSMContext):
             )
             
             if success:
-                hours = int(res['hours'])
-                minutes = int((res['hours'] * 60) % 60)
-                await message.answer(f"🏁 Смена завершена!\nВремя: {hours}ч {minutes}м\nСтатус: {res['status']}")
+                hours = int(res.hours)
+                minutes = int((res.hours * 60) % 60)
+                await message.answer(f"🏁 Смена завершена!\nВремя: {hours}ч {minutes}м\nСтатус: {res.status}")
             else:
                 await message.answer(f"⚠️ Ошибка при сохранении: {err}")
         except Exception as e:
@@ -1,5 +1,6 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple
 
 def get_main_menu_keyboard(has_active_shift: bool):
     text = "Завершить смену" if has_active_shift else "Начать работу"
@@ -12,6 +13,11 @@ def get_main_menu_keyboard(has_active_shift: bool):
     )
 
 def get_sites_keyboard(sites: List[str]):
+    return _build_sites_keyboard(tuple(sites))
+
+@lru_cache(maxsize=8)
+def _build_sites_keyboard(sites: Tuple[str, ...]):
+    # Same catalog -> same prebuilt markup
     buttons = [[KeyboardButton(text=site)] for site in sites]
     buttons.append([KeyboardButton(text="Отмена")])
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
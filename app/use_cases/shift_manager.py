@@ -1,65 +1,73 @@
-from datetime import datetime
+from dataclasses import replace
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, Tuple, List
-from app.infrastructure.storage.sqlite_state import SqliteStateStorage
-from app.infrastructure.storage.composite_storage import CompositeHistoryStorage
-from app.use_cases.user_manager import UserManager
+from app.domain.i_storage import IAsyncStateStorage, EVENT_START, EVENT_END, EVENT_COMPLETE, EVENT_MESSAGE
+from app.domain.shift import Shift
+from app.infrastructure.storage.history_outbox import OutboxDispatcher
+from app.use_cases.user_manager import AsyncUserManager
 from app.domain.i_calculator import ICalculator
-from app.infrastructure.storage.excel_sites import ExcelSitesRepository
+from app.domain.i_sites import ISitesRepository
 import asyncio
 from app.infrastructure.google.drive_manager import GoogleDriveManager
 
 class ShiftController:
     def __init__(self, 
-                 state_storage: SqliteStateStorage, 
-                 history_storage: CompositeHistoryStorage,
+                 state_storage: IAsyncStateStorage, 
+                 history: OutboxDispatcher,
                  calculator: ICalculator,
-                 sites_repo: ExcelSitesRepository,
-                 user_manager: UserManager,
+                 sites_repo: ISitesRepository,
+                 user_manager: AsyncUserManager,
                  drive_manager: GoogleDriveManager = None):
         self.state_storage = state_storage
-        self.history_storage = history_storage
+        # History writes go through the SQLite outbox: we only wait for the local commit
+        self.history = history
         self.calculator = calculator
         self.sites_repo = sites_repo
         self.user_manager = user_manager
         self.drive_manager = drive_manager
 
     # --- User Mgmt ---
-    def is_user_registered(self, user_id: int) -> bool:
-        return self.user_manager.get_user(user_id) is not None
+    async def is_user_registered(self, user_id: int) -> bool:
+        return await self.user_manager.get_user(user_id) is not None
 
-    def register_user(self, user_id: int, username: str, full_name: str, phone: str):
-        self.user_manager.register_user(user_id, username, full_name, phone)
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await self.user_manager.get_user(user_id)
+
+    async def register_user(self, user_id: int, username: str, full_name: str, phone: str):
+        await self.user_manager.register_user(user_id, username, full_name, phone)
 
     # --- Sites ---
     async def get_available_sites(self) -> List[str]:
         return await self.sites_repo.get_all_sites()
 
+    async def is_known_site(self, site_name: str) -> bool:
+        return await self.sites_repo.has_site(site_name)
+
     # --- Shift Flow Step-by-Step ---
     
-    def init_shift(self, user_id: int) -> bool:
-        """Step 1: User presse Start. Create record."""
-        # Check if active exists
-        if self.state_storage.get_active_shift(user_id):
-            return False
+    async def init_shift(self, user_id: int) -> Optional[str]:
+        """Step 1: User presse Start. Create record, return its shift ID."""
+        # Check if active exists (fast path; create_shift re-checks atomically)
+        if await self.state_storage.get_active_shift(user_id):
+            return None
         
-        self.state_storage.create_shift(user_id)
-        return True
+        return await self.state_storage.create_shift(user_id)
 
-    def set_shift_site(self, user_id: int, site_name: str) -> bool:
+    async def set_shift_site(self, user_id: int, site_name: str) -> bool:
         """Step 2: User picked site."""
-        shift = self.state_storage.get_active_shift(user_id)
+        shift = await self.state_storage.get_active_shift(user_id)
         if not shift: return False
         
         # We could validate site exists here
-        self.state_storage.update_shift(shift['shift_id'], {
+        await self.state_storage.update_shift(shift.shift_id, {
             "project": site_name,
             "status": "start_site_ok"
         })
         return True
 
-    def set_shift_start_geo(self, user_id: int, geo: str) -> bool:
+    async def set_shift_start_geo(self, user_id: int, geo: str) -> bool:
         """Step 3: User sent Geo."""
-        shift = self.state_storage.get_active_shift(user_id)
+        shift = await self.state_storage.get_active_shift(user_id)
         if not shift: return False
         
         # Validation Logic Placeholder (Radius check)
@@ -67,7 +75,7 @@ class ShiftController:
         # site_info = sites_data.get(shift['project'])
         # if site_info... check dist...
         
-        self.state_storage.update_shift(shift['shift_id'], {
+        await self.state_storage.update_shift(shift.shift_id, {
             "start_geo": geo,
             "status": "start_geo_ok"
         })
@@ -75,131 +83,100 @@ class ShiftController:
 
     async def set_shift_start_video(self, user_id: int, video_id: str, video_link: str = None) -> bool:
         """Step 4: User sent Video. Finalize Start Phase."""
-        shift = self.state_storage.get_active_shift(user_id)
+        shift = await self.state_storage.get_active_shift(user_id)
         if not shift: return False
 
         status = "active"
         if "file" in video_id:
              status = "active_warning"
 
-        self.state_storage.update_shift(shift['shift_id'], {
-            "start_video_id": video_id,
-            "status": status,
-            # We can store link in a custom field if DB supports, 
-            # or just rely on log. SQLite schema might not have start_video_path column?
-            # Creating proper log_data is what matters.
-        })
-        
-        # Log Start Sync (Async Call)
-        user = self.user_manager.get_user(user_id)
-        user_name = user['full_name'] if user else "Unknown"
-        
-        # Prepare data for logging
-        log_data = {
-            "shift_id": shift['shift_id'],
-            "user_id": user_id,
-            "user_name": user_name,
-            "project": shift['project'],
-            "start_time": shift['start_time'], # Check format? SQLite returns datetime usually if parsed
-            "start_geo": shift.get('start_geo', ''),
-            "start_video_path": video_link or "Pending Upload",
-            "status": "ACTIVE"
-        }
+        user = await self.user_manager.get_user(user_id)
         
-        # Fire and forget or await? Await is safer to ensure it's in sheet.
-        row_num = await self.history_storage.log_start_shift(log_data)
+        # Prepare record for logging (our own copy, safe to fill in)
+        record = replace(shift)
+        record.user_name = user['full_name'] if user else "Unknown"
+        record.start_video_id = video_id
+        record.start_video_path = video_link or "Pending Upload"
+        record.status = "ACTIVE"
         
-        if row_num:
-             self.state_storage.update_shift(shift['shift_id'], {"sheet_row": row_num})
+        # State change and start log event commit together; the dispatcher
+        # delivers it and remembers the sheet row for the end patch.
+        await self.state_storage.update_shift(shift.shift_id, {
+            "start_video_id": video_id,
+            "status": status,
+        }, event=(EVENT_START, record))
+        self.history.notify()
 
         return True
 
     # --- End Flow ---
     
-    def get_active_shift(self, user_id: int) -> Optional[Dict[str, Any]]:
-        return self.state_storage.get_active_shift(user_id)
+    async def get_active_shift(self, user_id: int) -> Optional[Shift]:
+        return await self.state_storage.get_active_shift(user_id)
 
-    def set_shift_end_geo(self, user_id: int, geo: str) -> bool:
-        shift = self.state_storage.get_active_shift(user_id)
+    async def set_shift_end_geo(self, user_id: int, geo: str) -> bool:
+        shift = await self.state_storage.get_active_shift(user_id)
         if not shift: return False
         
-        self.state_storage.update_shift(shift['shift_id'], {
+        await self.state_storage.update_shift(shift.shift_id, {
             "end_geo": geo,
             "status": "end_geo_ok"
         })
         return True
 
-    async def finalize_shift(self, user_id: int, video_id: str, start_video_link: str = None, end_video_link: str = None) -> Tuple[bool, str, Dict[str, Any]]:
-        shift = self.state_storage.get_active_shift(user_id)
-        if not shift: return False, "No active shift", {}
+    async def finalize_shift(self, user_id: int, video_id: str, start_video_link: str = None, end_video_link: str = None) -> Tuple[bool, str, Optional[Shift]]:
+        shift = await self.state_storage.get_active_shift(user_id)
+        if not shift: return False, "No active shift", None
 
         end_time = datetime.now()
-        start_time = shift['start_time']
         
         # Calc
-        hours = self.calculator.calculate_duration(start_time, end_time)
+        hours = self.calculator.calculate_duration(shift.start_time, end_time)
         
         # Use Drive links if available, otherwise use file_id
-        start_video_path = start_video_link if start_video_link else f"tg://{shift.get('start_video_id', 'NO_VIDEO')}"
+        start_video_path = start_video_link if start_video_link else f"tg://{shift.start_video_id or 'NO_VIDEO'}"
         end_video_path = end_video_link if end_video_link else f"tg://{video_id}"
 
         # Check Status
-        final_status = shift['status'] # Carry over warnings
+        final_status = shift.status # Carry over warnings
         if "|file" in video_id:
              final_status = "completed_warning"
         else:
              if "warning" not in final_status:
                  final_status = "completed_ok"
 
-        # Update DB (Close it)
-        self.state_storage.update_shift(shift['shift_id'], {
+        closing = {
             "end_time": end_time,
             "end_video_id": video_id,
             "status": final_status,
             "is_active": 0 # Close
-        })
+        }
 
-        # Log to History (Excel/Google)
-        # We need to fetch full Data.
-        user = self.user_manager.get_user(user_id)
-        user_name = user['full_name'] if user else "Unknown"
+        # Record for History (Excel/Google)
+        user = await self.user_manager.get_user(user_id)
         
-        log_data = {
-            "shift_id": shift['shift_id'],
-            "user_id": user_id,
-            "user_name": user_name,
-            "project": shift['project'],
-            "start_time": start_time,
-            "end_time": end_time,
-            "hours": hours,
-            "start_geo": shift['start_geo'],
-            "end_geo": geo if 'geo' in locals() else shift.get('end_geo'), # Fixed geo scope issue
-            "start_video_path": start_video_path,
-            "end_video_path": end_video_path,
-            "status": final_status
-        }
+        shift.apply(closing)
+        shift.user_name = user['full_name'] if user else "Unknown"
+        shift.hours = hours
+        shift.start_video_path = start_video_path
+        shift.end_video_path = end_video_path
         
-        # Await async logging
-        sheet_row = shift.get('sheet_row')
-        if sheet_row:
-             await self.history_storage.update_shift_end(sheet_row, log_data)
-        else:
-             await self.history_storage.log_completed_shift(log_data)
+        # Update DB (Close it) + end log event, one transaction
+        await self.state_storage.update_shift(shift.shift_id, closing, event=(EVENT_END, shift))
+        self.history.notify()
         
-        return True, "", log_data
+        return True, "", shift
     
     async def terminate_shift(self, user_id: int, reason: str) -> bool:
         """Force terminates the shift."""
-        shift = self.get_active_shift(user_id)
+        shift = await self.get_active_shift(user_id)
         if not shift:
              return False
         
-        shift_id = shift['shift_id']
-        start_time = shift['start_time']
         end_time = datetime.now()
         
         # Calculate hours
-        hours_worked = self.calculator.calculate_duration(start_time, end_time)
+        hours_worked = self.calculator.calculate_duration(shift.start_time, end_time)
         
         # Helper to get path
         def get_path(raw):
@@ -208,97 +185,79 @@ class ShiftController:
             if len(parts) >= 3: return parts[2]
             return "NO_PATH_SAVED"
 
-        start_path = get_path(shift.get('start_video_id'))
-        
         # Log to Storage
         status = f"TERMINATED: {reason}"
         
         # Get User Name properly
-        user = self.user_manager.get_user(user_id)
-        user_name = user['full_name'] if user else "Unknown"
+        user = await self.user_manager.get_user(user_id)
 
-        shift_data = {
-            "user_id": user_id,
-            "user_name": user_name,
-            "project": shift['project'],
-            "start_time": start_time,
-            "end_time": end_time,
-            "hours": hours_worked,
-            "start_geo": shift['start_geo'],
-            "end_geo": "TERMINATED",
-            "start_video_path": start_path,
-            "end_video_path": "TERMINATED",
-            "status": status
-        }
-        
-        # Async Log
-        await self.history_storage.log_completed_shift(shift_data)
+        shift.user_name = user['full_name'] if user else "Unknown"
+        shift.end_time = end_time
+        shift.hours = hours_worked
+        shift.end_geo = "TERMINATED"
+        shift.start_video_path = get_path(shift.start_video_id)
+        shift.end_video_path = "TERMINATED"
+        shift.status = status
         
-        # Close State
-        self.state_storage.update_shift(shift_id, {
+        # Close State + log event, one transaction
+        await self.state_storage.update_shift(shift.shift_id, {
             "end_time": end_time,
             "status": status,
             "is_active": 0
-        })
+        }, event=(EVENT_COMPLETE, shift))
+        self.history.notify()
         
         return True
 
-    def check_stale_shifts(self, hours: float):
-         return self.state_storage.get_all_active_shifts()
+    async def check_stale_shifts(self, hours_threshold: float) -> List[Shift]:
+        threshold = datetime.now() - timedelta(hours=hours_threshold)
+        shifts = await self.state_storage.get_all_active_shifts()
+        return [s for s in shifts if isinstance(s.start_time, datetime) and s.start_time < threshold]
 
     async def handle_manager_message(self, user_id: int, message: str):
         """Emergency reset and manager notification."""
-        import uuid
-        from datetime import datetime
-        
-        shift = self.state_storage.get_active_shift(user_id)
-        user = self.user_manager.get_user(user_id)
+        shift = await self.state_storage.get_active_shift(user_id)
+        user = await self.user_manager.get_user(user_id)
         user_name = user['full_name'] if user else "Unknown"
 
         if shift:
             # 1. Close Active Shift locally
-            shift_id = shift['shift_id']
             end_time = datetime.now()
             
-            # Update SQLite
-            self.state_storage.update_shift(shift_id, {
+            # 2. Patch the shift's log row (or log it whole if it never got one)
+            duration = end_time - shift.start_time
+            
+            record = replace(shift)
+            record.user_name = user_name
+            record.end_time = end_time
+            record.hours = round(duration.total_seconds() / 3600, 2)
+            record.end_geo = "FORCE_STOP"
+            record.end_video_path = "NONE"
+            record.status = f"MSG: {message}"
+            
+            # Update SQLite + log event, one transaction
+            await self.state_storage.update_shift(shift.shift_id, {
                 "status": "TERMINATED_BY_MANAGER_MSG",
                 "is_active": 0,
                 "end_time": end_time
-            })
-            
-            # 2. Update Google Sheet row if exists
-            sheet_row = shift.get('sheet_row')
-            if sheet_row:
-                 # Calculate duration
-                 start_time = shift['start_time']
-                 duration = end_time - start_time
-                 hours_val = round(duration.total_seconds() / 3600, 2)
-                 
-                 data = {
-                     "end_time": end_time,
-                     "hours": hours_val,
-                     "end_geo": "FORCE_STOP",
-                     "end_video_path": "NONE",
-                     "status": f"MSG: {message}"
-                 }
-                 await self.history_storage.update_shift_end(sheet_row, data)
+            }, event=(EVENT_END, record))
+            self.history.notify()
         else:
             # 3. Create a clean message log in Sheets
-            from datetime import datetime
-            short_id = f"M-{datetime.now().strftime('%H%M%S')}"
+            short_id = f"M-{await self.state_storage.allocate_event_id()}"
             
-            log_data = {
-                "shift_id": short_id,
-                "user_id": user_id,
-                "user_name": user_name,
-                "project": "MESSAGE_ONLY",
-                "start_time": datetime.now(),
-                "start_geo": "",
-                "start_video_path": "",
-                "status": "MESSAGE",
-                "comment": message
-            }
-            await self.history_storage.log_start_shift(log_data)
+            record = Shift(
+                shift_id=short_id,
+                user_id=user_id,
+                user_name=user_name,
+                project="MESSAGE_ONLY",
+                start_time=datetime.now(),
+                start_geo="",
+                start_video_path="",
+                status="MESSAGE",
+                comment=message
+            )
+            await self.state_storage.record_event(EVENT_MESSAGE, record)
+            self.history.notify()
         
         return True
@@ -1,103 +1,227 @@
-import sqlite3
-from typing import Optional, Dict, Any
-import pandas as pd
+from typing import Optional, Dict, Any, List
+from datetime import datetime
 import os
+import time
+import asyncio
+from openpyxl import load_workbook
+from app.infrastructure.storage.sqlite_connection import get_pool
+from app.infrastructure.storage.sqlite_migrations import apply_migrations
+from app.infrastructure.storage.db_executor import DbExecutor, get_db_executor
+from app.infrastructure.executors import get_executor
+
+MIGRATIONS = [
+    (1, ["""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            phone_number TEXT,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """]),
+    # Non-zero = changed since last mirror sync (value identifies the change)
+    (2, [
+        "ALTER TABLE users ADD COLUMN sync_pending INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_users_sync_pending ON users (sync_pending) WHERE sync_pending != 0",
+    ]),
+]
 
 class UserManager:
+    EXCEL_HEADERS = ["User ID", "Username", "Full Name", "Phone", "Registered At"]
+    GOOGLE_HEADERS = ["User ID", "Username", "Full Name", "Phone", "Registration Date"]
+
     def __init__(self, db_file: str, excel_file: str = None, google_storage = None):
         self.db_file = db_file
+        self.pool = get_pool(db_file)
         self.excel_file = excel_file
         self.google_storage = google_storage
+        self._google_rows: Optional[Dict[str, int]] = None # User ID -> row in Users sheet
         self._init_db()
 
     def set_google_storage(self, storage):
         self.google_storage = storage
+        self._google_rows = None
 
     def _init_db(self):
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    phone_number TEXT,
-                    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+        apply_migrations(self.pool, "users", MIGRATIONS)
 
     def register_user(self, user_id: int, username: str, full_name: str, phone: str):
-        # 1. SQLite
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR REPLACE INTO users (user_id, username, full_name, phone_number)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, username, full_name, phone))
-            conn.commit()
-            
-        # 2. Excel Sync
+        """Commits to SQLite only; Excel/Google mirrors are updated by sync_pending_users()."""
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO users (user_id, username, full_name, phone_number, registered_at, sync_pending)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, username, full_name, phone, datetime.now(), time.time_ns()))
+
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        conn = self.pool.connection()
+        row = conn.execute(
+            "SELECT user_id, username, full_name, phone_number FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row:
+            return {
+                "user_id": row[0],
+                "username": row[1],
+                "full_name": row[2],
+                "phone": row[3]
+            }
+        return None
+
+    # --- Mirror sync ---
+
+    def get_pending_users(self, limit: int = 200) -> List[Dict[str, Any]]:
+        rows = self.pool.connection().execute("""
+            SELECT user_id, username, full_name, phone_number, registered_at, sync_pending
+            FROM users WHERE sync_pending != 0 LIMIT ?
+        """, (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_synced(self, users: List[Dict[str, Any]]):
+        with self.pool.transaction() as conn:
+            # Only if unchanged meanwhile: a newer registration stays pending
+            conn.executemany(
+                "UPDATE users SET sync_pending = 0 WHERE user_id = ? AND sync_pending = ?",
+                [(u["user_id"], u["sync_pending"]) for u in users]
+            )
+
+    def sync_users(self, users: List[Dict[str, Any]]) -> bool:
+        """Upserts changed users into the Excel and Google Users sheets, one write batch each."""
+        excel_ok = self.sync_users_excel(users)
+        google_ok = self.sync_users_google(users)
+        return excel_ok and google_ok
+
+    def sync_users_excel(self, users: List[Dict[str, Any]]) -> bool:
         if self.excel_file and os.path.exists(self.excel_file):
             try:
-                # Add to Users sheet
-                new_user = {
-                    "User ID": user_id,
-                    "Username": username,
-                    "Full Name": full_name,
-                    "Phone": phone,
-                    "Registered At": pd.Timestamp.now()
-                }
-                
-                try:
-                    df = pd.read_excel(self.excel_file, sheet_name="Users")
-                    df = df[df["User ID"] != user_id]
-                    
-                    new_row = pd.DataFrame([new_user])
-                    df = pd.concat([df, new_row], ignore_index=True)
-                    
-                    with pd.ExcelWriter(self.excel_file, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                        df.to_excel(writer, sheet_name="Users", index=False)
-                except ValueError:
-                    pass
+                self._sync_excel(users)
             except Exception as e:
                 print(f"User Excel Sync Error: {e}")
+                return False
+        return True
 
-        # 3. Google Sync
-        if self.google_storage:
-             try:
-                 import datetime
-                 now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                 # Order: User ID, Username, Full Name, Phone, Reg Date
-                 row = [str(user_id), username or "", full_name, phone, now]
-                 
-                 # First ensure headers
-                 headers = ["User ID", "Username", "Full Name", "Phone", "Registration Date"]
-                 self.google_storage.manager.ensure_sheet_headers(
-                     self.google_storage.spreadsheet_id, 
-                     "Users", 
-                     headers
-                 )
-                 
-                 print(f"📝 Syncing User {user_id} to Google Sheets...")
-                 self.google_storage.manager.append_data(
-                     self.google_storage.spreadsheet_id, 
-                     "Users!A1", 
-                     [row]
-                 )
-             except Exception as e:
-                 print(f"❌ Google User Sync Error: {e}")
+    def sync_users_google(self, users: List[Dict[str, Any]]) -> bool:
+        if self.google_storage and self.google_storage.spreadsheet_id:
+            try:
+                self._sync_google(users)
+            except Exception as e:
+                print(f"❌ Google User Sync Error: {e}")
+                self._google_rows = None # Re-read the sheet next time
+                return False
+        return True
 
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        with sqlite3.connect(self.db_file) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    "user_id": row[0],
-                    "username": row[1],
-                    "full_name": row[2],
-                    "phone": row[3]
-                }
-        return None
+    @staticmethod
+    def _row(user: Dict[str, Any]) -> List[Any]:
+        registered = user["registered_at"]
+        if isinstance(registered, datetime):
+            registered = registered.strftime("%Y-%m-%d %H:%M:%S")
+        return [user["user_id"], user["username"] or "", user["full_name"], user["phone_number"], registered]
+
+    def _sync_excel(self, users: List[Dict[str, Any]]):
+        wb = load_workbook(self.excel_file)
+        if "Users" in wb.sheetnames:
+            ws = wb["Users"]
+        else:
+            ws = wb.create_sheet("Users")
+            ws.append(self.EXCEL_HEADERS)
+        existing = {}
+        for row_num, (value,) in enumerate(ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+            if value is not None:
+                existing[str(value)] = row_num
+        for user in users:
+            row = self._row(user)
+            row_num = existing.get(str(user["user_id"]))
+            if row_num:
+                for col, value in enumerate(row, start=1):
+                    ws.cell(row=row_num, column=col, value=value)
+            else:
+                ws.append(row)
+                existing[str(user["user_id"])] = ws.max_row
+        wb.save(self.excel_file)
+
+    def _sync_google(self, users: List[Dict[str, Any]]):
+        manager = self.google_storage.manager
+        sid = self.google_storage.spreadsheet_id
+        if self._google_rows is None:
+            manager.ensure_sheet_headers(sid, "Users", self.GOOGLE_HEADERS)
+            # From row 1: the header is always there, so an empty answer means a failed
+            # read, not an empty sheet (re-appending every user would duplicate them)
+            ids = manager.get_all_values(sid, "Users!A1:A")
+            if not ids:
+                raise RuntimeError("read of Users IDs failed")
+            self._google_rows = {str(r[0]): i for i, r in enumerate(ids[1:], start=2) if r}
+
+        updates, new_rows, new_ids = [], [], []
+        for user in users:
+            row = [str(v) if i == 0 else v for i, v in enumerate(self._row(user))]
+            row_num = self._google_rows.get(str(user["user_id"]))
+            if row_num:
+                updates.append((f"Users!A{row_num}:E{row_num}", [row]))
+            else:
+                new_rows.append(row)
+                new_ids.append(str(user["user_id"]))
+
+        if updates and not manager.batch_update_data(sid, updates):
+            raise RuntimeError(f"update of {len(updates)} Users rows failed")
+
+        if new_rows:
+            print(f"📝 Syncing {len(new_rows)} users to Google Sheets...")
+            result = manager.append_data(sid, "Users!A1", new_rows)
+            if not result:
+                raise RuntimeError("append to Users failed")
+            start_cell = result['updates']['updatedRange'].split('!')[-1].split(':')[0]
+            first_row = int("".join(filter(str.isdigit, start_cell)))
+            for offset, user_id in enumerate(new_ids):
+                self._google_rows[user_id] = first_row + offset
+
+class AsyncUserManager:
+    """
+    Awaitable UserManager. Registration only commits to SQLite (on the DB executor);
+    a background stage batches pending users into the Excel/Google mirrors.
+    """
+    def __init__(self, manager: UserManager, executor: DbExecutor = None,
+                 batch_window: float = 2.0, retry_interval: float = 60.0):
+        self.manager = manager
+        self.executor = executor or get_db_executor(manager.pool)
+        self.batch_window = batch_window
+        self.retry_interval = retry_interval
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Starts the mirror sync stage (also picks up users left pending before a restart)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def register_user(self, user_id: int, username: str, full_name: str, phone: str):
+        await self.executor.write(self.manager.register_user, user_id, username, full_name, phone)
+        self._wake.set()
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await self.executor.read(self.manager.get_user, user_id)
+
+    async def _sync_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.retry_interval)
+                # Let a whole crew's registrations land in one batch
+                await asyncio.sleep(self.batch_window)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while True:
+                    users = await self.executor.read(self.manager.get_pending_users)
+                    if not users:
+                        break
+                    # Google calls may sleep through rate limits and backoff: keep them
+                    # off the "files" pool so local Excel I/O isn't stuck behind them
+                    results = await asyncio.gather(
+                        loop.run_in_executor(get_executor("files"), self.manager.sync_users_excel, users),
+                        loop.run_in_executor(get_executor("sheets"), self.manager.sync_users_google, users),
+                    )
+                    if not all(results):
+                        break # Mirrors unavailable: retry later
+                    await self.executor.write(self.manager.mark_synced, users)
+            except Exception as e:
+                print(f"User Sync Error: {e}")
@@ -1,7 +1,6 @@
 """
 Video Upload Service - загрузка видео из Telegram на Google Drive
 """
-import asyncio
 import os
 import tempfile
 from typing import Optional
@@ -47,15 +46,11 @@ class VideoUploadService:
             
             print(f"📤 Uploading to Drive...")
             
-            # Загружаем на Drive в отдельном потоке (blocking operation)
-            loop = asyncio.get_running_loop()
-            drive_link = await loop.run_in_executor(
-                None,
-                lambda: self.drive_manager.upload_file(
-                    temp_path,
-                    self.folder_id,
-                    new_filename
-                )
+            # Загружаем на Drive асинхронно (без отдельного потока)
+            drive_link = await self.drive_manager.upload_file_async(
+                temp_path,
+                self.folder_id,
+                new_filename
             )
             
             if drive_link:
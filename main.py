@@ -18,18 +18,26 @@ from aiogram.enums import ParseMode
 
 from config import BOT_TOKEN, DB_FILE, EXCEL_FILE, GOOGLE_SHEET_ID
 from app.infrastructure.storage.sqlite_state import SqliteStateStorage
+from app.infrastructure.storage.async_state import AsyncSqliteStateStorage
+from app.infrastructure.storage.cached_state import CachedStateStorage
+from app.infrastructure.storage.sqlite_fsm import SqliteFSMStorage
 from app.infrastructure.storage.excel_storage import ExcelHistoryStorage
+from app.infrastructure.storage.excel_partitions import ExcelPartitions
 from app.domain.calculator import StandardTimeCalculator
 from app.use_cases.shift_manager import ShiftController
 from app.presentation.telegram.router_aggregator import setup_router
 
 from app.infrastructure.storage.excel_sites import ExcelSitesRepository
 from app.infrastructure.storage.composite_storage import CompositeHistoryStorage
+from app.infrastructure.storage.history_outbox import OutboxDispatcher
+from app.infrastructure.storage.circuit_breaker import BreakerHistoryStorage
 from app.infrastructure.google.drive_manager import GoogleDriveManager
 from app.infrastructure.google.sheets_manager import GoogleSheetsManager
+from app.infrastructure.google.request_executor import GoogleRequestExecutor
 from app.infrastructure.storage.google_sheets_storage import GoogleSheetsStorage
-from app.use_cases.user_manager import UserManager
+from app.use_cases.user_manager import UserManager, AsyncUserManager
 from app.use_cases.video.video_upload import VideoUploadService
+from app.infrastructure.executors import shutdown_executors
 
 async def stale_shift_checker(bot: Bot, controller: ShiftController):
     """Background task to check for long shifts."""
@@ -39,10 +47,10 @@ async def stale_shift_checker(bot: Bot, controller: ShiftController):
             await asyncio.sleep(3600) 
             
             # Get shifts active for > 24 hours
-            stale_shifts = controller.check_stale_shifts(hours_threshold=24.0)
+            stale_shifts = await controller.check_stale_shifts(hours_threshold=24.0)
             
             for shift in stale_shifts:
-                user_id = shift['user_id']
+                user_id = shift.user_id
                 # Notification
                 try:
                     await bot.send_message(
@@ -58,16 +66,71 @@ async def stale_shift_checker(bot: Bot, controller: ShiftController):
             logging.error(f"Background Check Error: {e}")
             await asyncio.sleep(60) # prevent loop spam on error
 
+async def shift_archiver(state_storage: CachedStateStorage):
+    """Background task moving closed shifts out of the hot table."""
+    while True:
+        try:
+            # Shifts are archived on close; this only sweeps leftovers (older DBs, failures)
+            moved = await state_storage.archive_closed_shifts(batch_size=500)
+            if moved:
+                logging.info(f"Archived {moved} closed shifts")
+        except Exception as e:
+            logging.error(f"Shift Archiver Error: {e}")
+        await asyncio.sleep(6 * 3600)
+
+async def replication_monitor(history_storage: CompositeHistoryStorage, interval: float = 60):
+    """Background task logging how far the mirrors are behind the primary."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for name, status in history_storage.replication_status().items():
+                logging.info(
+                    f"Mirror {name}: lag {status['lag']:.1f}s (last {status['last_lag']:.1f}s), "
+                    f"queued {status['queued']}, replicated {status['replicated']}, dropped {status['dropped']}"
+                    + (", promoted" if status['promoted'] else "")
+                )
+        except Exception as e:
+            logging.error(f"Replication Monitor Error: {e}")
+
+async def google_api_monitor(requests: GoogleRequestExecutor, interval: float = 60):
+    """Background task logging Google API pacing: queue depth, throttling, retries."""
+    last = requests.metrics()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = requests.metrics()
+            for api, m in current.items():
+                prev = last.get(api, {})
+                delta = {k: m[k] - prev.get(k, 0) for k in ("requests", "failures", "retries", "throttled", "wait_seconds")}
+                if not delta["requests"] and not m["waiting"]:
+                    continue # Idle
+                logging.info(
+                    f"Google {api}: {delta['requests']:.0f} requests, {delta['retries']:.0f} retries, "
+                    f"{delta['throttled']:.0f} throttled (429), {delta['failures']:.0f} failed, "
+                    f"waiting {m['waiting']:.0f}, waited {delta['wait_seconds']:.1f}s"
+                )
+            last = current
+        except Exception as e:
+            logging.error(f"Google API Monitor Error: {e}")
+
 async def main():
     if not BOT_TOKEN:
         print("Error: BOT_TOKEN is missing in .env")
         return
 
     # 1. Initialize Infrastructure
-    state_storage = SqliteStateStorage(DB_FILE)
+    # SQLite runs on its own DB thread, never on the event loop;
+    # live shifts are served from a write-through in-memory index
+    sqlite_state = SqliteStateStorage(DB_FILE)
+    state_storage = CachedStateStorage(AsyncSqliteStateStorage(sqlite_state))
+    await state_storage.load()
     
+    # Excel backup: monthly Shifts workbooks + small Users/Sites reference workbook
+    excel_partitions = ExcelPartitions(EXCEL_FILE)
+    excel_partitions.ensure_reference()
+
     # Init UserManager early to allow Google injection
-    user_manager = UserManager(DB_FILE, EXCEL_FILE)
+    user_manager = UserManager(DB_FILE, excel_partitions.reference_file)
     
     # History Storages (Google first, Excel as backup)
     storages = []
@@ -100,7 +163,8 @@ async def main():
              if GOOGLE_SHEET_ID:
                  google_storage = GoogleSheetsStorage(oauth_creds=creds)
                  google_storage.set_spreadsheet_id(GOOGLE_SHEET_ID)
-                 storages.append(google_storage)
+                 # Fast-fail while the Sheets API is down instead of waiting out timeouts
+                 storages.append(BreakerHistoryStorage(google_storage))
                  user_manager.set_google_storage(google_storage)
                  print(f"✅ Google Sheets - PRIMARY STORAGE (ID: {GOOGLE_SHEET_ID})")
              else:
@@ -114,11 +178,21 @@ async def main():
         print(f"⚠️ {oauth_creds_path} not found. Google Services disabled.")
     
     # Excel (Backup)
-    excel_storage = ExcelHistoryStorage(EXCEL_FILE)
-    storages.append(excel_storage)
+    excel_storage = ExcelHistoryStorage(excel_partitions)
+    storages.append(BreakerHistoryStorage(excel_storage))
     print("✅ Excel - BACKUP STORAGE")
 
-    history_storage = CompositeHistoryStorage(storages)
+    # Google is the synchronous primary; Excel (and any other backend) is an async mirror,
+    # promoted to synchronous writes while Google's circuit is open
+    history_storage = CompositeHistoryStorage(
+        storages, primary=google_storage.name if google_storage else None,
+        # Longer than the request executor's retry budget (~1 min of backoff), so a 429
+        # storm is ridden out instead of being cut off and replayed
+        timeouts={"google": 120}
+    )
+    # History events are committed to the SQLite outbox with the state change
+    # and delivered from there (replayed after outages/restarts)
+    history_outbox = OutboxDispatcher(sqlite_state.outbox, history_storage)
     
     if google_storage and GOOGLE_SHEET_ID:
         from app.infrastructure.storage.google_sites_repo import GoogleSitesRepository
@@ -126,16 +200,19 @@ async def main():
         sites_repo = GoogleSitesRepository(google_storage.manager, GOOGLE_SHEET_ID)
     else:
         print("⚠️ Using Excel Sites Repository (Local only)")
-        sites_repo = ExcelSitesRepository(EXCEL_FILE)
+        sites_repo = ExcelSitesRepository(excel_partitions.reference_file)
     calculator = StandardTimeCalculator()
 
     # 2. Initialize Logic
     # Pass drive_manager
-    controller = ShiftController(state_storage, history_storage, calculator, sites_repo, user_manager, drive_manager)
+    users = AsyncUserManager(user_manager)
+    controller = ShiftController(state_storage, history_outbox, calculator, sites_repo, users, drive_manager)
 
     # 3. Initialize UI
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    # FSM on SQLite: users keep their place in a flow across restarts
+    fsm_storage = SqliteFSMStorage(DB_FILE)
+    dp = Dispatcher(storage=fsm_storage)
     
     # Setup Router
     router = setup_router(controller, video_service)
@@ -143,10 +220,28 @@ async def main():
 
     # 4. Start Background Tasks
     asyncio.create_task(stale_shift_checker(bot, controller))
+    asyncio.create_task(shift_archiver(state_storage))
+    if history_storage.mirrors:
+        asyncio.create_task(replication_monitor(history_storage))
+    if google_storage:
+        asyncio.create_task(google_api_monitor(google_storage.manager.requests))
+    users.start() # Background Excel/Google user sync
+    history_outbox.start() # Delivers shift log events, starting with any left from last run
 
     # Start
     print("Modular Bot Started with Background Service!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await fsm_storage.close()
+        await history_outbox.close() # Last delivery attempt before the backends close
+        await history_storage.close() # Let the mirrors catch up
+        await excel_storage.close() # Flush buffered backup rows
+        if google_storage:
+            await google_storage.close() # Send queued Sheets writes
+        if drive_manager:
+            await drive_manager.close()
+        shutdown_executors()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.domain.i_storage import IHistoryStorage, EVENT_START
+from app.domain.shift import Shift
+from app.infrastructure.storage.composite_storage import CompositeHistoryStorage
+from app.infrastructure.storage.history_outbox import OutboxDispatcher
+from app.infrastructure.storage.sqlite_state import SqliteStateStorage
+
+class FakeHistory(IHistoryStorage):
+    def __init__(self, name: str):
+        self.name = name
+        self.started = []
+
+    async def log_completed_shift(self, shift: Shift) -> bool:
+        return True
+
+    async def log_start_shift(self, shift: Shift):
+        self.started.append(shift.shift_id)
+        return None
+
+    async def update_shift_end(self, row_num: int, shift: Shift) -> bool:
+        return True
+
+class MirrorAcknowledgeTest(unittest.TestCase):
+    def test_cursor_reaches_end_when_mirror_ack_fails_once(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state = SqliteStateStorage(os.path.join(tmp, "bot.db"))
+            primary, mirror = FakeHistory("google"), FakeHistory("excel")
+            history = CompositeHistoryStorage([primary, mirror], primary="google")
+            dispatcher = OutboxDispatcher(state.outbox, history)
+
+            acknowledge = state.outbox.acknowledge
+            failures = []
+            def flaky_acknowledge(acks, cursors=None):
+                # The mirror's ack (rows only, no cursor) fails the first time
+                if cursors == {} and not failures:
+                    failures.append(acks)
+                    raise RuntimeError("disk I/O error")
+                return acknowledge(acks, cursors)
+            state.outbox.acknowledge = flaky_acknowledge
+
+            last_seq = 0
+            for user_id in range(3):
+                shift_id = state.create_shift(user_id)
+                state.record_event(EVENT_START, Shift(shift_id, user_id, datetime.now()))
+                last_seq += 1
+
+            for _ in range(20):
+                await dispatcher.drain()
+                await asyncio.sleep(0.05) # Let the mirror worker apply what was queued
+                if state.outbox.cursors(["excel"])["excel"] == last_seq:
+                    break
+            await history.close()
+
+            self.assertEqual(len(failures), 1)
+            self.assertEqual(state.outbox.cursors(["google", "excel"]), {"google": last_seq, "excel": last_seq})
+
+if __name__ == "__main__":
+    unittest.main()